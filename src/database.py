@@ -1,11 +1,24 @@
 import sqlite3
 import json
+import orjson
 from contextlib import contextmanager
 from pathlib import Path
 
 BASE_DIR = Path(__file__).parent.parent
 DB_PATH = BASE_DIR / 'data' / 'lab_data.db'
 
+def loads_json(data):
+    """
+    Разбор JSON через orjson с откатом на стандартный json.
+    
+    json.dumps по умолчанию пишет NaN/Infinity, которые orjson не принимает,
+    поэтому такие записи (raw_data, загруженные файлы) разбираются стандартным json.
+    """
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+
 @contextmanager
 def get_db_connection():
     # check_same_thread=False критичен для Flask
@@ -16,6 +29,19 @@ def get_db_connection():
     finally:
         conn.close()
 
+# Индексы для поиска проб по имени и по серии (source_class, методика, повторность)
+PROBE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_name ON probes(name)",
+    "CREATE INDEX IF NOT EXISTS idx_series ON probes(source_class, method_number, exp_number)",
+)
+
+def ensure_indexes():
+    """Создает индексы поиска, если их еще нет (для баз, созданных до их появления)"""
+    with get_db_connection() as conn:
+        for statement in PROBE_INDEXES:
+            conn.execute(statement)
+        conn.commit()
+
 def save_probe(probe_data: dict):
     with get_db_connection() as conn:
         # SQLite сам заблокирует базу на время записи
@@ -41,4 +67,4 @@ def get_full_database():
         rows = conn.execute("SELECT raw_data FROM probes").fetchall()
         
         # Превращаем каждую строку обратно в словарь Python
-        return [json.loads(row['raw_data']) for row in rows]
\ No newline at end of file
+        return [loads_json(row['raw_data']) for row in rows]
\ No newline at end of file
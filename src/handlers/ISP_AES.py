@@ -1,14 +1,46 @@
 import pandas as pd
 import numpy as np
-from scipy.spatial.distance import pdist, squareform
 from typing import Any, Dict, List, Set, Tuple, Optional
 import traceback
 import re
 
-from middleware.raw_data_processing import expand_sample_code, get_base_name, merge_similar_samples, clean_value_icp_aes
+from middleware.raw_data_processing import expand_sample_code, expand_sample_codes, get_base_name, merge_similar_samples, clean_column_icp_aes
 
 black_list_column = ['Разбавление', 'sample_mass', 'Масса навески (g)', 'Valiq, ml']
 
+# Все, кроме цифр и точки, в обозначении длины волны
+WAVELENGTH_NON_NUMERIC_RE = re.compile(r'[^\d.]')
+# До этого числа длин волн у металла расстояния считаются без NumPy
+SMALL_WAVELENGTH_COUNT = 8
+
+def aggregate_metal_wavelengths(df: pd.DataFrame, metal_columns: Dict[str, List[str]]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Среднее и СКО по выбранным длинам волн каждого металла
+    
+    Args:
+        df: Таблица проб со столбцами длин волн
+        metal_columns: Металл -> список столбцов его длин волн
+    
+    Returns:
+        Tuple[DataFrame, DataFrame]: средние и СКО, столбцы - металлы, индекс как у df
+    """
+    # Все металлы сразу: столбцы группируются по металлу
+    column_metals = [metal for metal, cols in metal_columns.items() for _ in cols]
+    if not column_metals:
+        return pd.DataFrame(index=df.index), pd.DataFrame(index=df.index)
+    
+    columns = [col for cols in metal_columns.values() for col in cols]
+    grouped = df[columns].T.groupby(column_metals, sort=False)
+    metal_mean_data = grouped.mean().T
+    metal_std_data = grouped.std().T
+    
+    # Для металла с одной длиной волны СКО не определено - записываем 0
+    single_metals = [metal for metal, cols in metal_columns.items() if len(cols) == 1]
+    if single_metals:
+        metal_std_data[single_metals] = 0.0
+    
+    return metal_mean_data, metal_std_data
+
 def process_icp_aes_data(file_path: str, json_data_path: Optional[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Обрабатывает данные ИСП АЭС и интегрирует с базой данных
@@ -25,18 +57,23 @@ def process_icp_aes_data(file_path: str, json_data_path: Optional[str] = None) -
     df.rename(columns={f'{df.columns[0]}': 'name'}, inplace=True)
     
     # Удаление строк, где в столбце 'name' есть 'некал' или пустые строки
-    df = df[~df['name'].astype(str).str.contains('некал', case=False, na=False)]
-    df = df[df['name'].astype(str).str.strip() != '']
+    names = df['name'].astype(str)
+    df = df[~names.str.contains('некал', case=False, na=False) & (names.str.strip() != '')]
     
     black_dict = {}
     
-    # Применяем очистку ко всем столбцам, кроме 'name'
-    for col in df.columns:
-        if col != 'name':
-            df[col] = df[col].apply(clean_value_icp_aes)
+    # Столбцы со значениями (все, кроме 'name') определяем один раз
+    value_cols = [col for col in df.columns if col != 'name']
+    
+    # Применяем очистку ко всем столбцам, кроме 'name', и сразу отмечаем
+    # строки, в которых есть хотя бы одно значение
+    has_value = np.zeros(len(df), dtype=bool)
+    for col in value_cols:
+        df[col] = clean_column_icp_aes(df[col])
+        has_value |= df[col].notna().to_numpy()
     
     # Удаляем строки, где все значения NaN (после удаления 'некал')
-    df = df.dropna(how='all', subset=[col for col in df.columns if col != 'name'])
+    df = df[has_value]
     
     # Применяем группировку и объединение
     df['BaseName'] = df['name'].apply(get_base_name)
@@ -53,7 +90,7 @@ def process_icp_aes_data(file_path: str, json_data_path: Optional[str] = None) -
     df = pd.DataFrame(merged_rows)
     df = df.drop(columns=['BaseName'], errors='ignore')
     
-    df['name'] = df['name'].apply(expand_sample_code)
+    df['name'] = expand_sample_codes(df['name'])
     
     for col in df.columns:
         if col in black_list_column:
@@ -65,13 +102,10 @@ def process_icp_aes_data(file_path: str, json_data_path: Optional[str] = None) -
     
     for col in df.columns:
         if col != 'name':
-            parts = col.split(' ')
-            if len(parts) >= 2:
-                metal = parts[0]
-                wavelength = ' '.join(parts[1:])
-                if metal not in metal_wavelengths:
-                    metal_wavelengths[metal] = []
-                metal_wavelengths[metal].append((col, wavelength))
+            # "Fe 238.204" -> металл до первого пробела, длина волны - все после него
+            metal, sep, wavelength = col.partition(' ')
+            if sep:
+                metal_wavelengths.setdefault(metal, []).append((col, wavelength))
     
     # Функция для выбора 3 наиболее близких значений длин волн
     def select_closest_wavelengths(wavelength_list):
@@ -84,22 +118,28 @@ def process_icp_aes_data(file_path: str, json_data_path: Optional[str] = None) -
             return [(col, wl) for col, wl in wavelength_list]
         
         wavelength_values = []
-        wl_data = []
         for col, wl in wavelength_list:
+            # Числовая часть длины волны: оставляем только цифры и точку
             try:
-                wl_num = float(''.join(filter(lambda x: x.isdigit() or x == '.', wl)))
-                wavelength_values.append(wl_num)
-                wl_data.append((col, wl, wl_num))
-            except:
+                wl_num = float(WAVELENGTH_NON_NUMERIC_RE.sub('', wl))
+            except ValueError:
                 wl_num = 0
-                wavelength_values.append(wl_num)
-                wl_data.append((col, wl, wl_num))
+            wavelength_values.append(wl_num)
+        
+        n = len(wavelength_values)
+        if n <= SMALL_WAVELENGTH_COUNT:
+            # Для нескольких длин волн обычный цикл быстрее создания массивов NumPy.
+            # Сортировка устойчивая: при равных суммах раньше идет столбец из файла раньше
+            sum_distances = [sum(abs(v - u) for u in wavelength_values) for v in wavelength_values]
+            closest_indices = sorted(range(n), key=sum_distances.__getitem__)[:3]
+            return [(wavelength_list[i][0], wavelength_list[i][1]) for i in closest_indices]
         
         if len(wavelength_values) > 1:
-            distances = pdist(np.array(wavelength_values).reshape(-1, 1))
-            distance_matrix = squareform(distances)
-            sum_distances = distance_matrix.sum(axis=1)
-            closest_indices = np.argsort(sum_distances)[:3]
+            # Для одномерных значений матрица расстояний - это |x_i - x_j|, без pdist/squareform
+            values = np.array(wavelength_values)
+            sum_distances = np.abs(values[:, None] - values[None, :]).sum(axis=1)
+            # Тот же порядок при равных суммах, что и в ветке без NumPy
+            closest_indices = np.argsort(sum_distances, kind='stable')[:3]
             return [(wavelength_list[i][0], wavelength_list[i][1]) for i in closest_indices]
         else:
             return [(wavelength_list[0][0], wavelength_list[0][1])]
@@ -112,22 +152,19 @@ def process_icp_aes_data(file_path: str, json_data_path: Optional[str] = None) -
         numeric_cols = df.select_dtypes(include=[np.number]).columns
         non_numeric_cols = df.select_dtypes(exclude=[np.number]).columns
         
-        numeric_df = df[numeric_cols].copy()
+        # Суммы строк и столбцов по одному массиву (NaN считается нулем, как в DataFrame.sum)
+        values = df[numeric_cols].to_numpy(dtype=float)
+        row_mask = np.nansum(values, axis=1) != 0
+        col_mask = np.nansum(values[row_mask], axis=0) != 0
         
-        numeric_df = numeric_df[numeric_df.sum(axis=1) != 0]
-        numeric_df = numeric_df.loc[:, numeric_df.sum(axis=0) != 0]
-        
-        if len(non_numeric_cols) > 0:
-            result = pd.concat([df[non_numeric_cols], numeric_df], axis=1)
-            result = result.loc[numeric_df.index]
-        else:
-            result = numeric_df
-        
-        return result
+        # Одна выборка вместо concat + повторной индексации; нечисловые столбцы идут первыми
+        return df.loc[row_mask, list(non_numeric_cols) + list(numeric_cols[col_mask])]
     
     # Выбираем столбцы для каждого металла
     selected_columns = ['name']
     metal_selected_wavelengths = {}
+    # Подписи выбранных длин волн для сводки (первое слово после металла)
+    metal_wavelength_labels = {}
     
     for metal, wavelengths in metal_wavelengths.items():
         if wavelengths:
@@ -135,58 +172,32 @@ def process_icp_aes_data(file_path: str, json_data_path: Optional[str] = None) -
             selected_cols = [col for col, _ in selected_wavelengths]
             selected_columns.extend(selected_cols)
             metal_selected_wavelengths[metal] = selected_cols
+            metal_wavelength_labels[metal] = [wl.partition(' ')[0] for _, wl in selected_wavelengths]
     
-    result_df = df[selected_columns].copy()
-    
-    final_df = pd.DataFrame()
-    final_df['name'] = result_df['name']
+    # Выборка списка столбцов уже возвращает новую таблицу; result_df только читается
+    result_df = df[selected_columns]
     
-    metal_mean_data = {}
-    metal_std_data = {}
-    metal_raw_data = {}
-    
-    for metal, cols in metal_selected_wavelengths.items():
-        metal_raw_data[metal] = result_df[cols]
-    
-    for metal, metal_df in metal_raw_data.items():
-        if metal_df.shape[1] > 1:
-            metal_mean_data[metal] = metal_df.mean(axis=1)
-            metal_std_data[metal] = metal_df.std(axis=1)
-        else:
-            metal_mean_data[metal] = metal_df.iloc[:, 0]
-            metal_std_data[metal] = pd.Series(0, index=metal_df.index)
+    metal_mean_data, metal_std_data = aggregate_metal_wavelengths(result_df, metal_selected_wavelengths)
     
-    for metal in metal_mean_data.keys():
-        final_df[f'{metal}_AES'] = metal_mean_data[metal]
-    
-    for metal in metal_std_data.keys():
-        final_df[f'd{metal}'] = metal_std_data[metal]
-    
-    sorted_columns = ['name']
-    metals_sorted = sorted(metal_mean_data.keys())
-
-    for metal in metals_sorted:
-        sorted_columns.append(f'{metal}_AES')
-    
-    for metal in metals_sorted:
-        sorted_columns.append(f'd{metal}')
+    metals_sorted = sorted(metal_mean_data.columns)
     
-    final_df = final_df[sorted_columns]
+    # Итоговая таблица собирается одним concat в нужном порядке столбцов:
+    # name, затем {металл}_AES, затем d{металл}
+    final_df = pd.concat([
+        result_df[['name']],
+        metal_mean_data[metals_sorted].add_suffix('_AES'),
+        metal_std_data[metals_sorted].add_prefix('d'),
+    ], axis=1)
     final_df = remove_zero_sum_rows_columns_safe(final_df)
     
     wavelengths_info = []
     for metal in metals_sorted:
         cols = metal_selected_wavelengths.get(metal, [])
         if cols:
-            wl_list = []
-            for col in cols:
-                parts = col.split(' ')
-                if len(parts) >= 2:
-                    wl_list.append(parts[1])
             wavelengths_info.append({
                 'Металл': metal,
                 'Количество_длин_волн': len(cols),
-                'Длины_волн': ', '.join(wl_list)
+                'Длины_волн': ', '.join(metal_wavelength_labels[metal])
             })
     
     wavelengths_df = pd.DataFrame(wavelengths_info)
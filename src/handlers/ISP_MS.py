@@ -1,7 +1,7 @@
 import pandas as pd
 import re
 
-from middleware.raw_data_processing import expand_sample_code, get_base_name, merge_similar_samples, convert_to_mcg_per_l
+from middleware.raw_data_processing import expand_sample_code, expand_sample_codes, get_base_name, merge_similar_samples, convert_column_to_mcg_per_l
 
 def process_metal_samples_csv(file_path, output_path=None):
     """
@@ -60,13 +60,13 @@ def process_metal_samples_csv(file_path, output_path=None):
     df = df.drop(columns=['BaseName'], errors='ignore')
     
     # Восстановление полного шифра из короткого
-    df['name'] = df['name'].apply(expand_sample_code)
+    df['name'] = expand_sample_codes(df['name'])
     
     # Пересчет всех концентраций в мкг/л
     for col in df.columns:
         if col != 'name' and col in column_units:
             unit = column_units[col]
-            df[col] = df[col].apply(lambda x: convert_to_mcg_per_l(x, unit))
+            df[col] = convert_column_to_mcg_per_l(df[col], unit)
     
     # Обработка названий столбцов (приведение к правильным названиям элементов)
     def normalize_column_name(col_name):
@@ -1,10 +1,14 @@
 from flask import Flask, render_template, request, jsonify, send_file,render_template_string
+from flask.json.provider import JSONProvider
 from datetime import datetime
 import json
+import orjson
+import decimal
 import os
 import logging
 from werkzeug.utils import secure_filename
-from handlers.ISP_MS import process_metal_samples_csv, expand_sample_code
+from handlers.ISP_MS import process_metal_samples_csv
+from middleware.raw_data_processing import expand_sample_codes
 from handlers.ISP_AES import process_icp_aes_data
 from middleware.series_worker import get_series_dicts, get_source_class_from_probe, get_probe_type,get_type_name_from_pattern_type
 from mass_balance.series_analyzer import analyze_series, get_series_summary, FIELD_VALIDATION_CONFIG
@@ -26,14 +30,34 @@ from app.params import settings
 from database_processing.func_db import ProbeDatabase
 from logger.logging import HTTPHandler
 from logging.handlers import RotatingFileHandler
-from database import get_db_connection, get_full_database
+from database import get_db_connection, get_full_database, loads_json
 import shutil
 import tempfile
 load_dotenv()
 
 BASE_DIR = Path(__file__).parent.parent
 
+def _orjson_default(obj):
+    """Типы, которые orjson не сериализует сам (как в стандартном провайдере Flask)"""
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class OrjsonProvider(JSONProvider):
+    """JSON-провайдер Flask на orjson: jsonify и request.json без stdlib json"""
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        # NaN/Infinity (их принимал стандартный провайдер) разбираются через json
+        return loads_json(s)
+
 app = Flask(__name__, template_folder=str(BASE_DIR /'src'/ 'templates'), static_folder=str(BASE_DIR /'src'/ 'static'))
+app.json = OrjsonProvider(app)
 CORS(app)
 # Черный список полей, которые не должны отображаться как оси
 BLACKLIST_FIELDS = {
@@ -153,6 +177,37 @@ def generate_result_filename(original_filename):
     name, ext = os.path.splitext(original_filename)
     return f"{name}_result_{timestamp}.json"
 
+def get_db_etag() -> str:
+    """ETag состояния БД: mtime и размер основного файла и WAL-журнала"""
+    parts = []
+    for path in (DB_PATH, DB_PATH + '-wal'):
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+        except FileNotFoundError:
+            parts.append('0')
+    return '-'.join(parts)
+
+# Серии из get_series_dicts, пересобираются только при изменении файлов БД
+_series_cache = {'etag': None, 'value': None}
+
+def get_series_dicts_cached(etag: str):
+    """get_series_dicts с кэшем по ETag БД (см. get_db_etag). Результат только для чтения"""
+    if _series_cache['etag'] != etag:
+        _series_cache['value'] = get_series_dicts()
+        _series_cache['etag'] = etag
+    return _series_cache['value']
+
+# Результат analyze_series (анализатор серий), кэшируется так же по ETag БД
+_analysis_cache = {'etag': None, 'value': None}
+
+def analyze_series_cached(etag: str):
+    """analyze_series с кэшем по ETag БД. Результат только для чтения"""
+    if _analysis_cache['etag'] != etag:
+        _analysis_cache['value'] = analyze_series()
+        _analysis_cache['etag'] = etag
+    return _analysis_cache['value']
+
 def convert_df_to_dict(df:pd.DataFrame):
     df['id'] = df.index + 1
     
@@ -542,7 +597,7 @@ def upload_data():
         
         result_data = pd.read_csv(file_path,sep=';')
         
-        result_data['name'] = result_data['name'].apply(expand_sample_code)
+        result_data['name'] = expand_sample_codes(result_data['name'])
         
         json_data = convert_df_to_dict(result_data)
         
@@ -600,7 +655,7 @@ def preview_synthes():
     try:
         # Обрабатываем данные (используем вашу существующую функцию)
         result_data = pd.read_csv(temp_path,sep=';')
-        result_data['name'] = result_data['name'].apply(expand_sample_code)
+        result_data['name'] = expand_sample_codes(result_data['name'])
         
         new_probes = convert_df_to_dict(result_data) # type: ignore
         
@@ -1003,7 +1058,6 @@ def extract_series_info() -> Dict:
         
         # Определяем стадию и тип пробы
         name = probe['name']
-        print(name)
         if f"T2-{m}A{n}" in name or f"T2-{m}B{n}" in name:
             stage = 'start'
             sample_type = 'A' if 'A' in name else 'B'
@@ -1037,6 +1091,34 @@ def extract_series_info() -> Dict:
     
     return series_dict
 
+def _is_float_convertible(value) -> bool:
+    """Значение проходит float(), как при построении точек графика (в т.ч. числа строкой)"""
+    try:
+        float(value)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def get_numeric_columns(series_dict: Dict) -> Set[str]:
+    """Числовые поля проб из серий, которые можно использовать как оси графика"""
+    columns = set()
+    for series_info in series_dict.values():
+        for probe in series_info['probes'].values():
+            for key, value in probe.items():
+                if key not in columns and _is_float_convertible(value):
+                    columns.add(key)
+    return columns - BLACKLIST_FIELDS
+
+# Набор допустимых осей графика, пересчитывается только при изменении файлов БД
+_numeric_columns_cache = {'etag': None, 'value': None}
+
+def get_numeric_columns_cached(etag: str, series_dict: Dict) -> Set[str]:
+    """get_numeric_columns с кэшем по ETag БД (см. get_db_etag). Результат только для чтения"""
+    if _numeric_columns_cache['etag'] != etag:
+        _numeric_columns_cache['value'] = get_numeric_columns(series_dict)
+        _numeric_columns_cache['etag'] = etag
+    return _numeric_columns_cache['value']
+
 @app.route('/api/series')
 def get_series():
     """Получение списка доступных серий"""
@@ -1047,6 +1129,36 @@ def get_series():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Оформление графика (светлая тема): не зависит от запроса, собираем один раз.
+# Plotly копирует переданные словари в свои объекты, поэтому их можно переиспользовать.
+_PALETTE = (
+    '#2b6cb0', '#3182ce', '#4299e1', '#63b3ed', '#90cdf4',  # Blue scale
+    '#38a169', '#48bb78', '#68d391', '#9ae6b4',  # Green scale
+    '#d69e2e', '#ed8936', '#f6ad55', '#fbd38d',  # Orange scale
+    '#9f7aea', '#b794f4', '#d6bcfa',  # Purple scale
+)
+_TITLE_FONT = dict(size=20, color='#2b6cb0')
+_AXIS_TITLE_FONT = dict(size=14, color='#4a5568')
+_BASE_LAYOUT_AXIS = dict(
+    gridcolor='#e2e8f0',
+    zerolinecolor='#cbd5e0',
+    linecolor='#cbd5e0',
+    mirror=True
+)
+_BASE_LAYOUT = dict(
+    plot_bgcolor='white',
+    paper_bgcolor='white',
+    font=dict(color='#2d3748', family='Arial, sans-serif'),
+    hovermode='closest',
+    showlegend=True,
+    legend=dict(
+        font=dict(color='#4a5568'),
+        bgcolor='rgba(255, 255, 255, 0.8)',
+        bordercolor='#e2e8f0'
+    ),
+    margin=dict(l=50, r=50, t=80, b=50)
+)
+
 @app.route('/api/plot', methods=['POST'])
 def create_plot():
     """API для создания графика с поддержкой серий"""
@@ -1061,28 +1173,30 @@ def create_plot():
         if not x_axis or not y_axis:
             return jsonify({"error": "Не указаны оси X и Y"}), 400
         
+        # ETag берем до чтения серий: если БД изменится между ними, кэш пересчитается при следующем запросе
+        etag = get_db_etag()
         series_dict = extract_series_info()
         
+        # Неизвестные оси отсекаем сразу, не перебирая все пробы
+        numeric_columns = get_numeric_columns_cached(etag, series_dict)
+        if x_axis not in numeric_columns or y_axis not in numeric_columns:
+            return jsonify({"error": "Неизвестная ось X или Y"}), 400
+        
         if analysis_mode == 'average':
             # Используем все серии для усреднения
             selected_series = list(series_dict.keys())
         
         # Фильтрация данных в зависимости от режима
         plot_data = []
-        colors = [
-            '#2b6cb0', '#3182ce', '#4299e1', '#63b3ed', '#90cdf4',  # Blue scale
-            '#38a169', '#48bb78', '#68d391', '#9ae6b4',  # Green scale
-            '#d69e2e', '#ed8936', '#f6ad55', '#fbd38d',  # Orange scale
-            '#9f7aea', '#b794f4', '#d6bcfa',  # Purple scale
-        ]
         
         for i, series_name in enumerate(selected_series):
             if series_name not in series_dict:
                 continue
             
             series_info = series_dict[series_name]
-            print(series_info)
-            series_data = []
+            app.logger.debug('series_info=%r', series_info)
+            # Точки серии храним по столбцам, а не словарем на каждую пробу
+            x_vals, y_vals, point_names, sample_types = [], [], [], []
             
             # Собираем данные для серии
             for probe_name, probe_data in series_info['probes'].items():
@@ -1109,33 +1223,35 @@ def create_plot():
                         if pd.isna(x_val) or pd.isna(y_val):
                             continue
                         
-                        series_data.append({
-                            'x': x_val,
-                            'y': y_val,
-                            'name': probe_name,
-                            'sample_type': sample_type,
-                            'series': series_name
-                        })
+                        x_vals.append(x_val)
+                        y_vals.append(y_val)
+                        point_names.append(probe_name)
+                        sample_types.append(sample_type)
                     except (ValueError, TypeError):
                         continue
             
-            if series_data:
+            if x_vals:
                 plot_data.append({
                     'series_name': series_name,
-                    'data': series_data,
-                    'color': colors[i % len(colors)]
+                    'x': np.asarray(x_vals, dtype=np.float64),
+                    'y': np.asarray(y_vals, dtype=np.float64),
+                    'names': point_names,
+                    'sample_types': np.asarray(sample_types),
+                    'color': _PALETTE[i % len(_PALETTE)]
                 })
         
-        # Создаем график в зависимости от режима
+        # Создаем график в зависимости от режима.
+        # В трассы передаем списки, а не массивы NumPy: plotly>=6 сериализует массивы
+        # в base64 (bdata), который не читает подключенный в шаблоне plotly.js 2.24.1
         fig = go.Figure()
         
         if analysis_mode == 'single':
             # Одна серия - один график
             if plot_data:
-                series_data = plot_data[0]['data']
+                series_data = plot_data[0]
                 fig.add_trace(go.Scatter(
-                    x=[d['x'] for d in series_data],
-                    y=[d['y'] for d in series_data],
+                    x=series_data['x'].tolist(),
+                    y=series_data['y'].tolist(),
                     mode='markers+lines',
                     name=plot_data[0]['series_name'],
                     marker=dict(
@@ -1144,18 +1260,17 @@ def create_plot():
                         line=dict(width=2, color='white')
                     ),
                     line=dict(width=2, color=plot_data[0]['color']),
-                    hovertext=[d['name'] for d in series_data],
+                    hovertext=series_data['names'],
                     hoverinfo='text+x+y',
-                    customdata=[[d['series'], d['sample_type']] for d in series_data]
+                    customdata=[[series_data['series_name'], t] for t in series_data['sample_types'].tolist()]
                 ))
         
         elif analysis_mode == 'multiple':
             # Несколько серий - несколько линий
             for series_info in plot_data:
-                series_data = series_info['data']
                 fig.add_trace(go.Scatter(
-                    x=[d['x'] for d in series_data],
-                    y=[d['y'] for d in series_data],
+                    x=series_info['x'].tolist(),
+                    y=series_info['y'].tolist(),
                     mode='markers+lines',
                     name=series_info['series_name'],
                     marker=dict(
@@ -1164,39 +1279,38 @@ def create_plot():
                         line=dict(width=1, color='white')
                     ),
                     line=dict(width=2, color=series_info['color'], dash='dash'),
-                    hovertext=[d['name'] for d in series_data],
+                    hovertext=series_info['names'],
                     hoverinfo='text+x+y',
-                    customdata=[[d['series'], d['sample_type']] for d in series_data]
+                    customdata=[[series_info['series_name'], t] for t in series_info['sample_types'].tolist()]
                 ))
         
         elif analysis_mode == 'average':
             # Среднее по сериям
-            # Группируем по типам проб
-            sample_types = {}
-            for series_info in plot_data:
-                for point in series_info['data']:
-                    sample_type = point['sample_type']
-                    if sample_type not in sample_types:
-                        sample_types[sample_type] = []
-                    sample_types[sample_type].append(point)
-            
-            for sample_type, points in sample_types.items():
-                if len(points) < 2:
-                    continue
-                
-                # Сортируем по X для правильного построения линии
-                points.sort(key=lambda p: p['x'])
+            # Группируем по типам проб масками по объединенным столбцам
+            if plot_data:
+                avg_x = np.concatenate([s['x'] for s in plot_data])
+                avg_y = np.concatenate([s['y'] for s in plot_data])
+                avg_types = np.concatenate([s['sample_types'] for s in plot_data])
                 
-                fig.add_trace(go.Scatter(
-                    x=[p['x'] for p in points],
-                    y=[p['y'] for p in points],
-                    mode='lines+markers',
-                    name=f'Avg {sample_type}-type',
-                    marker=dict(size=10),
-                    line=dict(width=3),
-                    hovertext=[f"Average of {len(selected_series)} series" for _ in points],
-                    hoverinfo='text+x+y'
-                ))
+                for sample_type in dict.fromkeys(avg_types.tolist()):
+                    mask = avg_types == sample_type
+                    if np.count_nonzero(mask) < 2:
+                        continue
+                    
+                    # Сортируем по X для правильного построения линии
+                    type_x = avg_x[mask]
+                    order = np.argsort(type_x, kind='stable')
+                    
+                    fig.add_trace(go.Scatter(
+                        x=type_x[order].tolist(),
+                        y=avg_y[mask][order].tolist(),
+                        mode='lines+markers',
+                        name=f'Avg {sample_type}-type',
+                        marker=dict(size=10),
+                        line=dict(width=3),
+                        hovertext=f"Average of {len(selected_series)} series",
+                        hoverinfo='text+x+y'
+                    ))
         
         elif analysis_mode == 'percentage':
             # Процентный анализ
@@ -1263,54 +1377,31 @@ def create_plot():
                         y=[p['y'] for p in stage_points],
                         mode='markers+lines',
                         name=f'{stage_name} ({sample_type})',
-                        marker=dict(size=10, color=colors[i % len(colors)]),
-                        line=dict(width=2, color=colors[i % len(colors)]),
+                        marker=dict(size=10, color=_PALETTE[i % len(_PALETTE)]),
+                        line=dict(width=2, color=_PALETTE[i % len(_PALETTE)]),
                         hovertext=[f"{p['series']}: {p['actual']:.2f}/{p['reference']:.2f}" for p in stage_points],
                         hoverinfo='text+x+y'
                     ))
         
         # Настройка стиля графика (светлая тема)
         fig.update_layout(
-            plot_bgcolor='white',
-            paper_bgcolor='white',
-            font=dict(color='#2d3748', family='Arial, sans-serif'),
+            **_BASE_LAYOUT,
             title=dict(
                 text=f'{y_axis} vs {x_axis} - {analysis_mode.title()} Mode',
-                font=dict(size=20, color='#2b6cb0')
-            ),
-            xaxis=dict(
-                title=dict(text=x_axis, font=dict(size=14, color='#4a5568')),
-                gridcolor='#e2e8f0',
-                zerolinecolor='#cbd5e0',
-                linecolor='#cbd5e0',
-                mirror=True
+                font=_TITLE_FONT
             ),
-            yaxis=dict(
-                title=dict(text=y_axis, font=dict(size=14, color='#4a5568')),
-                gridcolor='#e2e8f0',
-                zerolinecolor='#cbd5e0',
-                linecolor='#cbd5e0',
-                mirror=True
-            ),
-            hovermode='closest',
-            showlegend=True,
-            legend=dict(
-                font=dict(color='#4a5568'),
-                bgcolor='rgba(255, 255, 255, 0.8)',
-                bordercolor='#e2e8f0'
-            ),
-            margin=dict(l=50, r=50, t=80, b=50)
+            xaxis=dict(title=dict(text=x_axis, font=_AXIS_TITLE_FONT), **_BASE_LAYOUT_AXIS),
+            yaxis=dict(title=dict(text=y_axis, font=_AXIS_TITLE_FONT), **_BASE_LAYOUT_AXIS)
         )
         
         # Рассчитываем статистику
-        all_x = []
-        all_y = []
-        for series_info in plot_data:
-            for point in series_info['data']:
-                all_x.append(point['x'])
-                all_y.append(point['y'])
-        
-        if all_x and all_y:
+        if plot_data:
+            all_x = np.concatenate([s['x'] for s in plot_data])
+            all_y = np.concatenate([s['y'] for s in plot_data])
+        else:
+            all_x = all_y = np.empty(0)
+        
+        if all_x.size and all_y.size:
             # Вычисляем R²
             if len(all_x) > 1:
                 correlation_matrix = np.corrcoef(all_x, all_y)
@@ -1347,8 +1438,8 @@ def create_plot():
         })
         
     except Exception as e:
-        print(f"Error in create_plot: {str(e)}")
-        traceback.print_exc()
+        app.logger.error(f"Error in create_plot: {str(e)}")
+        app.logger.debug(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
       
 @app.route('/api/probes', methods=['GET'])
@@ -1455,32 +1546,114 @@ def parse_probe_name():
 def render_mass():
     return render_template('mass.html')
 
+# Константы баланса: не зависят от запроса, собираем один раз при импорте
+BASE_ELEMENTS = ('Fe', 'Cu', 'Ni', 'Pd', 'Pt', 'Rh', 'Au', 'Ag', 'Os', 'Ru', 'Ir',
+                 'K', 'Al', 'Mg', 'Co', 'Zn', 'Ca', 'Mn')
+ELEMENTS_AES = tuple(f'm{e}_AES' for e in BASE_ELEMENTS)
+ELEMENTS_MS = tuple(f'm{e}_MS' for e in BASE_ELEMENTS)
+ELEMENTS_BASE = tuple(f'm{e}' for e in BASE_ELEMENTS)
+
+# Элементы всех методов подряд (AES, MS, без суффикса) - считаются одним массивом
+BALANCE_ELEMENTS = ELEMENTS_AES + ELEMENTS_MS + ELEMENTS_BASE
+BALANCE_ELEMENT_KEYS = tuple(element.casefold() for element in BALANCE_ELEMENTS)
+
+# Правила связи между стадиями 5 и 6
+FALLBACK_RULES_ST6 = {
+    "st6_E": "st5_B",  # E из 6 стадии можно взять из B 5 стадии
+    "st6_G": "st5_A"   # G из 6 стадии можно взять из A 5 стадии
+}
+
+# Типы проб, которые нас интересуют для баланса
+BALANCE_PROBE_TYPES = ('start_A', 'start_B', 'st2_A', 'st2_B', 'st3_A', 'st3_B',
+                       'st4_A', 'st4_B', 'st4_D', 'st5_A', 'st5_B', 'st6_E', 'st6_G')
+
+# Пары проб A/B для стадий 1-5 (стадия 6 собирается из E/G)
+STAGE_PROBES = (('start_A', 'start_B'), ('st2_A', 'st2_B'), ('st3_A', 'st3_B'),
+                ('st4_A', 'st4_B'), ('st5_A', 'st5_B'))
+STAGE_KEYS = ('A', 'B', 'D', 'E', 'G')
+# Пробы, наличие которых отдается в probe_availability
+AVAILABILITY_TYPES = ('st5_A', 'st5_B', 'st6_E', 'st6_G')
+BALANCE_KEYS = ('input', 'D', 'E', 'G', 'Recycle', 'Loss',
+                'D_pct', 'E_pct', 'G_pct', 'Recycle_pct', 'Loss_pct')
+
+def compute_balance_arrays(rows: Dict[str, np.ndarray], fallback_E_type: str, fallback_G_type: str):
+    """
+    Численная часть баланса серии: на входе строки значений по типам проб
+    (массивы по элементам), на выходе массивы сразу для всех элементов.
+    
+    Returns:
+        (balance, out_E_used, out_G_used, fallback_E, fallback_G), где balance -
+        округленная матрица (элемент x BALANCE_KEYS)
+    """
+    input_val = rows['start_A'] + rows['start_B']
+    out_D = rows['st4_D']
+    out_E_actual = rows['st6_E']
+    out_G_actual = rows['st6_G']
+    
+    # Применяем fallback правила: пустая проба 6 стадии берется из 5 стадии
+    fallback_E_src = rows[fallback_E_type]
+    fallback_G_src = rows[fallback_G_type]
+    fallback_E = (out_E_actual == 0) & (fallback_E_src != 0)
+    fallback_G = (out_G_actual == 0) & (fallback_G_src != 0)
+    out_E_used = np.where(fallback_E, fallback_E_src, out_E_actual)
+    out_G_used = np.where(fallback_G, fallback_G_src, out_G_actual)
+    
+    # Расчет баланса
+    total_out = out_D + out_E_used + out_G_used
+    loss = input_val - total_out
+    calc_base = np.where(input_val != 0, input_val, 1.0)
+    
+    # G и Recycle - одна и та же величина, считаем ее процент один раз
+    G_pct = out_G_used / calc_base * 100
+    balance = np.round(np.stack([
+        input_val, out_D, out_E_used, out_G_used, out_G_used, loss,
+        out_D / calc_base * 100, out_E_used / calc_base * 100,
+        G_pct, G_pct, loss / calc_base * 100
+    ], axis=1), 9)
+    
+    return balance, out_E_used, out_G_used, fallback_E, fallback_G
+
 @app.route('/api/calculate_balance')
 def calculate_balance():
-    # Получаем все серии с start_C одной оптимизированной функцией
-    series_dicts = get_series_dicts()
-    series_list = []
+    # Результат зависит только от содержимого БД: при неизменной БД отдаем 304
+    etag = get_db_etag()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
     
-    # Предварительно компилируем список элементов для всех методов
-    base_elements = ['Fe', 'Cu', 'Ni', 'Pd', 'Pt', 'Rh', 'Au', 'Ag', 'Os', 'Ru', 'Ir', 
-                     'K', 'Al', 'Mg', 'Co', 'Zn', 'Ca', 'Mn']
-    
-    # Создаем маппинг методов к суффиксам и полным именам элементов
-    method_configs = [
-        {'suffix': '_AES', 'elements': [f'm{e}_AES' for e in base_elements]},
-        {'suffix': '_MS', 'elements': [f'm{e}_MS' for e in base_elements]},
-        {'suffix': '', 'elements': [f'm{e}' for e in base_elements]}
-    ]
+    # Получаем все серии с start_C (из кэша, если БД не менялась)
+    series_dicts = get_series_dicts_cached(etag)
+    series_list = []
     
-    # Правила связи между стадиями 5 и 6 (выносим за цикл как константу)
-    FALLBACK_RULES_ST6 = {
-        "st6_E": "st5_B",  # E из 6 стадии можно взять из B 5 стадии
-        "st6_G": "st5_A"   # G из 6 стадии можно взять из A 5 стадии
+    # Нулевой элемент для серий, где кроме start_C нет ни одной пробы баланса.
+    # Один объект на все такие элементы: ответ только сериализуется и не изменяется
+    zero_element = {
+        "balance": {**dict.fromkeys(BALANCE_KEYS, 0.0), "fallback_used": {"E": False, "G": False}},
+        "stages": [dict.fromkeys(STAGE_KEYS, 0.0) for _ in range(len(STAGE_PROBES) + 1)],
+        "probe_details": dict.fromkeys(('st5_A', 'st5_B', 'st6_E', 'st6_G', 'st6_E_actual',
+                                        'st6_G_actual', 'st6_E_used', 'st6_G_used'), 0.0)
     }
     
-    # Типы проб, которые нас интересуют для баланса
-    PROBE_TYPES = ['start_A', 'start_B', 'st2_A', 'st2_B', 'st3_A', 'st3_B', 
-                   'st4_A', 'st4_B', 'st4_D', 'st5_A', 'st5_B', 'st6_E', 'st6_G']
+    # Индекс имя пробы -> значения, один на весь запрос: каждая проба приводится к float один раз.
+    # Ключи нормализуем через casefold, чтобы искать без вариантов регистра
+    probe_vals = {}
+    for series in series_dicts:
+        for p_type in BALANCE_PROBE_TYPES:
+            probe = series.get(p_type)
+            name = probe.get('name', '') if probe else ''
+            if not name or name in probe_vals:
+                continue
+            vals = {}
+            for key, value in probe.items():
+                if value is None or value == "":
+                    vals[key.casefold()] = 0.0
+                    continue
+                try:
+                    vals[key.casefold()] = float(value)
+                except (ValueError, TypeError):
+                    pass
+            probe_vals[name] = vals
     
     for series in series_dicts:
         # Проверяем наличие start_C через оптимизированный доступ
@@ -1496,22 +1669,8 @@ def calculate_balance():
         probe_type, m, n = probe_type_info
         source_class = get_source_class_from_probe(start_c_probe)
         
-        # Формируем словарь с именами проб и создаем probe_map одной операцией
-        names = {}
-        probe_map = {}
-        
-        for probe_type in PROBE_TYPES:
-            probe = series.get(probe_type, {})
-            name = probe.get('name', '')
-            names[probe_type] = name
-            if name and probe:
-                probe_map[name] = probe
-        
-        # Создаем lookup для fallback правил
-        fallback_lookup = {
-            names['st6_E']: names.get(FALLBACK_RULES_ST6['st6_E']),
-            names['st6_G']: names.get(FALLBACK_RULES_ST6['st6_G'])
-        }
+        # Имена проб серии по типам
+        names = {p_type: series.get(p_type, {}).get('name', '') for p_type in BALANCE_PROBE_TYPES}
         
         # Инициализируем данные серии
         series_data = {
@@ -1521,122 +1680,64 @@ def calculate_balance():
             "repeat": n,
             "elements": {},
             "probe_availability": {
-                "st5_A": bool(names.get('st5_A')),
-                "st5_B": bool(names.get('st5_B')),
-                "st6_E": bool(names.get('st6_E')),
-                "st6_G": bool(names.get('st6_G')),
+                **{p_type: bool(names[p_type]) for p_type in AVAILABILITY_TYPES},
                 "used_fallback": False
             }
         }
         
-        # Оптимизированная функция получения значения с кэшированием
-        def get_probe_value_cached(probe_name, element_key, cache={}):
-            cache_key = f"{probe_name}:{element_key}"
-            if cache_key in cache:
-                return cache[cache_key]
-            
-            if probe_name not in probe_map:
-                cache[cache_key] = 0
-                return 0
-            
-            probe = probe_map[probe_name]
-            
-            # Пробуем разные варианты ключа
-            for key_variant in [element_key, element_key.lower(), element_key.upper()]:
-                if key_variant in probe:
-                    value = probe[key_variant]
-                    try:
-                        result = float(value) if value not in [None, ""] else 0
-                        cache[cache_key] = result
-                        return result
-                    except (ValueError, TypeError):
-                        pass
-            
-            cache[cache_key] = 0
-            return 0
-        
-        # Функция для расчета данных для одного элемента
-        def calculate_element_data(element, base_element, method_suffix=""):
-            # Получаем значения с кэшированием
-            input_val = (get_probe_value_cached(names['start_A'], element) + 
-                        get_probe_value_cached(names['start_B'], element))
-            
-            # Основные выходные продукты
-            out_D = get_probe_value_cached(names['st4_D'], element)
-            out_E_actual = get_probe_value_cached(names['st6_E'], element)
-            out_G_actual = get_probe_value_cached(names['st6_G'], element)
-            
-            # Применяем fallback правила
-            out_E_used = out_E_actual
-            out_G_used = out_G_actual
-            fallback_E = False
-            fallback_G = False
-            
-            if out_E_actual == 0 and fallback_lookup[names['st6_E']]:
-                out_E_used = get_probe_value_cached(fallback_lookup[names['st6_E']], element)
-                fallback_E = (out_E_used != 0)
-            
-            if out_G_actual == 0 and fallback_lookup[names['st6_G']]:
-                out_G_used = get_probe_value_cached(fallback_lookup[names['st6_G']], element)
-                fallback_G = (out_G_used != 0)
-            
-            if fallback_E or fallback_G:
-                series_data["probe_availability"]["used_fallback"] = True
-            
-            # Расчет баланса
-            total_out = out_D + out_E_used + out_G_used
-            loss = input_val - total_out
-            calc_base = input_val if input_val != 0 else 1
-            
-            # Создаем данные стадий одной операцией
-            stages = [
-                {'A': get_probe_value_cached(names['start_A'], element), 'B': get_probe_value_cached(names['start_B'], element), 'D': 0.0, 'E': 0.0, 'G': 0.0},
-                {'A': get_probe_value_cached(names['st2_A'], element), 'B': get_probe_value_cached(names['st2_B'], element), 'D': 0.0, 'E': 0.0, 'G': 0.0},
-                {'A': get_probe_value_cached(names['st3_A'], element), 'B': get_probe_value_cached(names['st3_B'], element), 'D': 0.0, 'E': 0.0, 'G': 0.0},
-                {'A': get_probe_value_cached(names['st4_A'], element), 'B': get_probe_value_cached(names['st4_B'], element), 'D': out_D, 'E': 0.0, 'G': 0.0},
-                {'A': get_probe_value_cached(names['st5_A'], element), 'B': get_probe_value_cached(names['st5_B'], element), 'D': 0.0, 'E': 0.0, 'G': 0.0},
-                {'A': 0.0, 'B': 0.0, 'D': 0.0, 'E': out_E_used, 'G': out_G_used}
-            ]
-            
-            # Округляем значения
-            for stage in stages:
-                for k in stage:
-                    stage[k] = round(stage[k], 9)
-            
-            return {
-                "balance": {
-                    "input": round(input_val, 9),
-                    "D": round(out_D, 9),
-                    "E": round(out_E_used, 9),
-                    "G": round(out_G_used, 9),
-                    "Recycle": round(out_G_used, 9),
-                    "Loss": round(loss, 9),
-                    "D_pct": round((out_D / calc_base) * 100, 9),
-                    "E_pct": round((out_E_used / calc_base) * 100, 9),
-                    "G_pct": round((out_G_used / calc_base) * 100, 9),
-                    "Recycle_pct": round((out_G_used / calc_base) * 100, 9),
-                    "Loss_pct": round((loss / calc_base) * 100, 9),
-                    "fallback_used": {"E": fallback_E, "G": fallback_G}
-                },
-                "stages": stages,
+        if not any(names.values()):
+            series_data["elements"] = dict.fromkeys(BALANCE_ELEMENTS, zero_element)
+            series_list.append(series_data)
+            continue
+        
+        # Матрица значений (тип пробы x элемент) сразу для всех методов: один проход NumPy на серию
+        values = np.array([
+            [vals.get(key, 0.0) for key in BALANCE_ELEMENT_KEYS]
+            for vals in (probe_vals.get(names[p_type], {}) for p_type in BALANCE_PROBE_TYPES)
+        ], dtype=np.float64)
+        rows = dict(zip(BALANCE_PROBE_TYPES, values))
+        
+        balance, out_E_used, out_G_used, fallback_E, fallback_G = compute_balance_arrays(
+            rows, FALLBACK_RULES_ST6['st6_E'], FALLBACK_RULES_ST6['st6_G'])
+        # Флаг берем прямо из масок fallback, без повторной проверки значений
+        series_data["probe_availability"]["used_fallback"] = bool(fallback_E.any() or fallback_G.any())
+        balance = balance.tolist()
+        
+        # Данные стадий: (элемент, стадия, A/B/D/E/G)
+        stages = np.zeros((len(BALANCE_ELEMENTS), len(STAGE_PROBES) + 1, len(STAGE_KEYS)))
+        for i, (probe_a, probe_b) in enumerate(STAGE_PROBES):
+            stages[:, i, 0] = rows[probe_a]
+            stages[:, i, 1] = rows[probe_b]
+        stages[:, 3, 2] = rows['st4_D']
+        stages[:, -1, 3] = out_E_used
+        stages[:, -1, 4] = out_G_used
+        stages = np.round(stages, 9).tolist()
+        
+        details = np.stack([
+            rows['st5_A'], rows['st5_B'], rows['st6_E'], rows['st6_G'], out_E_used, out_G_used
+        ], axis=1).tolist()
+        fallback_E = fallback_E.tolist()
+        fallback_G = fallback_G.tolist()
+        
+        for j, element in enumerate(BALANCE_ELEMENTS):
+            element_balance = dict(zip(BALANCE_KEYS, balance[j]))
+            element_balance["fallback_used"] = {"E": fallback_E[j], "G": fallback_G[j]}
+            st5_A, st5_B, E_actual, G_actual, E_used, G_used = details[j]
+            series_data["elements"][element] = {
+                "balance": element_balance,
+                "stages": [dict(zip(STAGE_KEYS, stage)) for stage in stages[j]],
                 "probe_details": {
-                    "st5_A": get_probe_value_cached(names['st5_A'], element),
-                    "st5_B": get_probe_value_cached(names['st5_B'], element),
-                    "st6_E": out_E_actual,
-                    "st6_G": out_G_actual,
-                    "st6_E_actual": out_E_actual,
-                    "st6_G_actual": out_G_actual,
-                    "st6_E_used": out_E_used,
-                    "st6_G_used": out_G_used
+                    "st5_A": st5_A,
+                    "st5_B": st5_B,
+                    "st6_E": E_actual,
+                    "st6_G": G_actual,
+                    "st6_E_actual": E_actual,
+                    "st6_G_actual": G_actual,
+                    "st6_E_used": E_used,
+                    "st6_G_used": G_used
                 }
             }
         
-        # Рассчитываем данные для всех методов и элементов
-        for config in method_configs:
-            for element in config['elements']:
-                base_element = element.replace('m', '').replace('_AES', '').replace('_MS', '')
-                series_data["elements"][element] = calculate_element_data(element, base_element, config['suffix'])
-        
         series_list.append(series_data)
     
     # Добавляем статистику по использованию fallback
@@ -1652,13 +1753,25 @@ def calculate_balance():
                 "fallback_percentage": fallback_percentage
             }
     
-    return jsonify(series_list)
+    # Статистика нужна каждой серии, поэтому серии считаются целиком, но в JSON
+    # кодируются по одной: без общей строки ответа и ее повторного перекодирования в байты
+    def generate():
+        yield b'['
+        for i, series_data in enumerate(series_list):
+            if i:
+                yield b','
+            yield orjson.dumps(series_data, default=_orjson_default, option=OrjsonProvider.option)
+        yield b']'
+    
+    response = app.response_class(generate(), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
 
 def is_valid_json(file_path):
     """Проверяем, что файл содержит валидный JSON"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            json.load(f)
+        with open(file_path, 'rb') as f:
+            loads_json(f.read())
         return True
     except (json.JSONDecodeError, UnicodeDecodeError) as e:
         logger.error(f"Invalid JSON file: {e}")
@@ -1688,7 +1801,7 @@ def delete_field():
 def render_analyzer():
     """Главная страница"""
     try:
-        series_list, total_series = analyze_series()
+        series_list, total_series = analyze_series_cached(get_db_etag())
         return render_template('series_analyzer.html', total_series=total_series)
     except Exception as e:
         return render_template('series_analyzer.html', error=str(e), total_series=0)
@@ -1697,7 +1810,7 @@ def render_analyzer():
 def get_series_analyzer():
     """API: Получение списка всех серий (для боковой панели)"""
     try:
-        series_list, total_series = analyze_series()
+        series_list, total_series = analyze_series_cached(get_db_etag())
         series_summaries = [get_series_summary(s) for s in series_list]
         return jsonify({
             'success': True,
@@ -1724,7 +1837,7 @@ def get_series_details(series_id):
         exp_number = int(exp_str)
         
         # Получаем все серии
-        series_list, _ = analyze_series()
+        series_list, _ = analyze_series_cached(get_db_etag())
         
         # Ищем нужную серию
         target_series = None
@@ -1,6 +1,8 @@
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
+from functools import lru_cache
 import sys
+import re
 from app.params import settings
 from database import get_db_connection
 from middleware import series_worker
@@ -16,6 +18,16 @@ BLACKLIST_FIELDS = {
     "status_id", "is_solution", "name", "tags"
 }
 
+# Ключи концентраций с суффиксом метода: символ элемента до 3 знаков с заглавной буквы
+_SUFFIXED_ELEMENT_RE = re.compile(r'^([A-Z].{0,2})_(AES|MS)$')
+# Старые поля без суффикса: Fe, Mg, ...
+_BASE_ELEMENT_RE = re.compile(r'^[A-Z][a-z]{0,2}$')
+_BASE_ELEMENT_EXCLUDED = frozenset(('V', 'Ca', 'Co', 'Cu', 'Fe', 'Ni', 'Pd', 'Pt', 'Rh'))
+
+# Пустые значения полей пробы. Кортежи, а не frozenset: значение может оказаться списком
+_MISSING = (None, 'null', '')
+_MISSING_OR_ZERO = (None, 0, 'null')
+
 stats = {
     'liquid_probes': 0,           # Пробы с разбавлением
     'solid_probes': 0,            # Пробы с массой твердого
@@ -31,40 +43,61 @@ stats = {
     'new_mass_fields_ms': []      # Поля масс MS
 }
 
-def calculate_mass_for_element(element, concentration_field, mass_field_prefix, probe, probe_name, 
-                                dilution_float=None, volume_float=None, 
-                                aliquot_float=None, solid_mass_float=None, sample_weight_float=None):
-    """Рассчитывает массу для конкретного элемента и метода анализа"""
+@lru_cache(maxsize=None)
+def _mass_fields(element: str, suffix: str) -> Tuple[str, str]:
+    """Имена полей концентрации и массы элемента: ('Fe', '_AES') -> ('Fe_AES', 'mFe_AES')"""
+    concentration_field = f'{element}{suffix}'
+    return concentration_field, f'm{concentration_field}'
+
+def _present_fields(probe: dict, elements, suffix: str) -> list:
+    """Таблица (элемент, поле концентрации, поле массы) только для полей, которые есть в пробе"""
+    table = []
+    for element in elements:
+        concentration_field, mass_field = _mass_fields(element, suffix)
+        if concentration_field in probe:
+            table.append((element, concentration_field, mass_field))
+    return table
+
+def add_tag(probe: dict, tag: str) -> bool:
+    """Добавляет тег в пробу, если его еще нет. Возвращает True, если тег добавлен"""
+    tags = probe.setdefault('tags', [])
+    if tag in tags:
+        return False
+    tags.append(tag)
+    return True
+
+def calculate_mass_for_element(concentration_field, mass_field, probe, 
+                                liquid_factor=None, solid_factor=None):
+    """
+    Рассчитывает массу для конкретного элемента и метода анализа.
+    Имя поля массы (mFe_AES, mFe_MS, mFe) передает вызывающий код, который знает метод.
+    Множители формул считаются один раз на пробу:
+    - жидкая проба: liquid_factor = Разбавление * V_эфф(ml) / 1000
+    - твердая проба: solid_factor = V_aliq * sample_mass / Масса навески
+    """
     
     # Проверяем наличие концентрации
-    if concentration_field not in probe or probe[concentration_field] in [None, 'null', '']:
+    value = probe.get(concentration_field)
+    if value in _MISSING:
         return False, None
     
     try:
-        concentration = float(probe[concentration_field])
+        concentration = float(value)
         
         # Расчет в зависимости от типа пробы
-        if dilution_float is not None and volume_float is not None:
+        if liquid_factor is not None:
             # Жидкая проба
-            if "L" not in probe_name:
-                mass = concentration * dilution_float * ((volume_float - probe.get('Масса твердого (g)', 0)/settings.SOLID_DENCITY_PARAM) / 1000.0)
-            else:
-                mass = concentration * dilution_float * volume_float / 1000.0
+            mass = concentration * liquid_factor
         
-        elif aliquot_float is not None and solid_mass_float is not None and sample_weight_float is not None:
+        elif solid_factor is not None:
             # Твердая проба
-            if solid_mass_float == 0:
-                return False, None
-            mass = (aliquot_float * concentration * sample_weight_float) / solid_mass_float
+            mass = concentration * solid_factor
         
         else:
             return False, None
         
-        # Формируем имя поля для массы
-        mass_field = f'm{mass_field_prefix}'
-        
-        # Сохраняем результат
-        probe[mass_field] = float(mass)
+        # Сохраняем результат (mass уже float: concentration и множители приведены выше)
+        probe[mass_field] = mass
         
         return True, mass_field
         
@@ -102,10 +135,7 @@ def process_mass_calculate(probe: dict):
         if 'name' not in probe:
             error_msg = f"В пробе id={probe_id} отсутствует поле 'name'"
             logger.error(error_msg)
-            if 'tags' not in probe:
-                probe['tags'] = []
-            if 'ошибка: отсутствует name' not in probe['tags']:
-                probe['tags'].append('ошибка: отсутствует name')
+            add_tag(probe, 'ошибка: отсутствует name')
             return probe
             
         probe_name = probe['name']
@@ -114,42 +144,24 @@ def process_mass_calculate(probe: dict):
         # Анализируем ключи пробы
         logger.debug(f"Анализ ключей пробы. Всего ключей: {len(probe.keys())}")
         
-        for key in probe.keys():
-            try:
-                # Проверяем на AES элементы
-                if key.endswith('_AES'):
-                    base_element = key[:-4]
-                    logger.debug(f"Найден AES элемент: {base_element} из ключа {key}")
-                    if (len(base_element) <= 3 and 
-                        base_element[0].isupper() and 
-                        base_element not in BLACKLIST_FIELDS and
-                        not base_element.endswith('_MS')):
+        for key in probe:
+            # Проверяем на AES / MS элементы (Fe_AES, Pd_MS)
+            match = _SUFFIXED_ELEMENT_RE.match(key)
+            if match:
+                base_element, method = match.groups()
+                if base_element not in BLACKLIST_FIELDS:
+                    if method == 'AES':
                         metal_elements_aes.add(base_element)
-                        logger.debug(f"Добавлен AES элемент в обработку: {base_element}")
-                
-                # Проверяем на MS элементы
-                elif key.endswith('_MS'):
-                    base_element = key[:-3]
-                    logger.debug(f"Найден MS элемент: {base_element} из ключа {key}")
-                    if (len(base_element) <= 3 and 
-                        base_element[0].isupper() and 
-                        base_element not in BLACKLIST_FIELDS and
-                        not base_element.endswith('_AES')):
+                    else:
                         metal_elements_ms.add(base_element)
-                        logger.debug(f"Добавлен MS элемент в обработку: {base_element}")
-                
-                # Для совместимости со старыми полями без суффиксов
-                elif (len(key) <= 3 and 
-                        key[0].isupper() and 
-                        key not in ['V', 'Ca', 'Co', 'Cu', 'Fe', 'Ni', 'Pd', 'Pt', 'Rh'] and
-                        key not in BLACKLIST_FIELDS):
-                    if all(c.islower() for c in key[1:]):
-                        metal_elements_base.add(key)
-                        logger.debug(f"Добавлен базовый элемент в обработку: {key}")
-                        
-            except Exception as e:
-                logger.error(f"Ошибка при анализе ключа '{key}': {str(e)}")
-                logger.error(traceback.format_exc())
+            
+            # Для совместимости со старыми полями без суффиксов
+            elif (_BASE_ELEMENT_RE.match(key) and
+                  key not in _BASE_ELEMENT_EXCLUDED and
+                  key not in BLACKLIST_FIELDS):
+                metal_elements_base.add(key)
+        
+        logger.debug(f"Элементы из ключей пробы: AES={metal_elements_aes}, MS={metal_elements_ms}, BASE={metal_elements_base}")
         
         # Добавляем основные элементы
         basic_elements = ['Fe', 'Cu', 'Ni', 'Ca', 'Co', 'Pd', 'Pt', 'Rh', 
@@ -160,6 +172,13 @@ def process_mass_calculate(probe: dict):
         metal_elements_base.update(basic_elements)
         logger.info(f"Найдено элементов для обработки: AES={len(metal_elements_aes)}, MS={len(metal_elements_ms)}, BASE={len(metal_elements_base)}")
         
+        # Таблицы (элемент, поле концентрации, поле массы) - строки имен берутся из кэша,
+        # основные элементы без колонки в пробе отсекаются сразу
+        aes_fields = _present_fields(probe, metal_elements_aes, '_AES')
+        ms_fields = _present_fields(probe, metal_elements_ms, '_MS')
+        # Старые поля без суффикса - только присутствующие в пробе
+        base_fields = [(element, _mass_fields(element, '')[1]) for element in metal_elements_base & probe.keys()]
+        
         # Определяем тип продукта
         try:
             product_type = series_worker.get_product_type(probe_name)
@@ -171,10 +190,7 @@ def process_mass_calculate(probe: dict):
         
         if product_type == 'Undefined':
             logger.warning(f"Неопределенный тип продукта для пробы {probe_name}, пропускаем")
-            if 'tags' not in probe:
-                probe['tags'] = []
-            if 'неопределенный тип продукта' not in probe['tags']:
-                probe['tags'].append('неопределенный тип продукта')
+            add_tag(probe, 'неопределенный тип продукта')
             return probe
         
         elif product_type == 'Liquid' or product_type == 'Recycle':
@@ -183,7 +199,7 @@ def process_mass_calculate(probe: dict):
             dilution = probe.get('Разбавление')
             logger.debug(f"Разбавление: {dilution}")
             
-            if dilution is not None and dilution != 0 and dilution != 'null':
+            if dilution not in _MISSING_OR_ZERO:
                 try:
                     dilution_float = float(dilution)
                     volume_ml = probe.get('V (ml)', 0)
@@ -193,15 +209,21 @@ def process_mass_calculate(probe: dict):
                         volume_float = float(volume_ml)
                         logger.info(f"Параметры жидкой пробы: dilution={dilution_float}, volume={volume_float}")
                         
+                        # Тип формулы определяется один раз на пробу: для проб без "L" в имени
+                        # из объема вычитается объем твердого
+                        if "L" not in probe_name:
+                            solid_g = float(probe.get('Масса твердого (g)', 0) or 0)
+                            volume_float -= solid_g / settings.SOLID_DENCITY_PARAM
+                        liquid_factor = dilution_float * volume_float / 1000.0
+                        
                         # Расчет для AES элементов
-                        for element in metal_elements_aes:
+                        for element, element_aes, mass_field_aes in aes_fields:
                             try:
-                                element_aes = f"{element}_AES"
                                 logger.debug(f"Обработка AES элемента {element} через поле {element_aes}")
                                 
                                 success, mass_field = calculate_mass_for_element(
-                                    element, element_aes, element_aes, probe, probe_name,
-                                    dilution_float=dilution_float, volume_float=volume_float
+                                    element_aes, mass_field_aes, probe,
+                                    liquid_factor=liquid_factor
                                 )
                                 if success:
                                     probe_modified = True
@@ -211,14 +233,13 @@ def process_mass_calculate(probe: dict):
                                 logger.error(traceback.format_exc())
                         
                         # Расчет для MS элементов
-                        for element in metal_elements_ms:
+                        for element, element_ms, mass_field_ms in ms_fields:
                             try:
-                                element_ms = f"{element}_MS"
                                 logger.debug(f"Обработка MS элемента {element} через поле {element_ms}")
                                 
                                 success, mass_field = calculate_mass_for_element(
-                                    element, element_ms, element_ms, probe, probe_name,
-                                    dilution_float=dilution_float, volume_float=volume_float
+                                    element_ms, mass_field_ms, probe,
+                                    liquid_factor=liquid_factor
                                 )
                                 if success:
                                     probe_modified = True
@@ -228,17 +249,16 @@ def process_mass_calculate(probe: dict):
                                 logger.error(traceback.format_exc())
                         
                         # Расчет для старых элементов без суффикса
-                        for element in metal_elements_base:
+                        for element, mass_field_base in base_fields:
                             try:
-                                if element in probe:
-                                    logger.debug(f"Обработка базового элемента {element}")
-                                    success, mass_field = calculate_mass_for_element(
-                                        element, element, element, probe, probe_name,
-                                        dilution_float=dilution_float, volume_float=volume_float
-                                    )
-                                    if success:
-                                        probe_modified = True
-                                        logger.debug(f"Успешно рассчитан базовый элемент {element}, поле {mass_field}")
+                                logger.debug(f"Обработка базового элемента {element}")
+                                success, mass_field = calculate_mass_for_element(
+                                    element, mass_field_base, probe,
+                                    liquid_factor=liquid_factor
+                                )
+                                if success:
+                                    probe_modified = True
+                                    logger.debug(f"Успешно рассчитан базовый элемент {element}, поле {mass_field}")
                             except Exception as e:
                                 logger.error(f"Ошибка при расчете базового элемента {element}: {str(e)}")
                                 logger.error(traceback.format_exc())
@@ -249,10 +269,7 @@ def process_mass_calculate(probe: dict):
                     logger.error(f"dilution={dilution}, volume_ml={volume_ml}") # type: ignore
                     logger.error(traceback.format_exc())
                     
-                    if 'tags' not in probe:
-                        probe['tags'] = []
-                    if 'ошибка расчета жидкой пробы' not in probe['tags']:
-                        probe['tags'].append('ошибка расчета жидкой пробы')
+                    if add_tag(probe, 'ошибка расчета жидкой пробы'):
                         probe_modified = True
             else:
                 logger.warning(f"Отсутствует разбавление для жидкой пробы {probe_name}")
@@ -263,7 +280,7 @@ def process_mass_calculate(probe: dict):
             solid_mass = probe.get('Масса навески (g)')
             logger.debug(f"Масса навески: {solid_mass}")
             
-            if solid_mass is not None and solid_mass != 0 and solid_mass != 'null':
+            if solid_mass not in _MISSING_OR_ZERO:
                 try:
                     solid_mass_float = float(solid_mass)
                     aliquot_volume = probe.get('V_aliq (l)', 0)
@@ -282,17 +299,19 @@ def process_mass_calculate(probe: dict):
                             logger.error(error_msg)
                             raise ValueError(error_msg)
                         
+                        # Общий множитель формулы для всех элементов пробы
+                        # (при нулевой массе навески массы не считаются, как и раньше)
+                        solid_factor = (aliquot_float * sample_weight_float / solid_mass_float
+                                        if solid_mass_float != 0 else None)
+                        
                         # Расчет для AES элементов
-                        for element in metal_elements_aes:
+                        for element, element_aes, mass_field_aes in aes_fields:
                             try:
-                                element_aes = f"{element}_AES"
                                 logger.debug(f"Обработка AES элемента {element} для твердой пробы")
                                 
                                 success, mass_field = calculate_mass_for_element(
-                                    element, element_aes, element_aes, probe, probe_name,
-                                    aliquot_float=aliquot_float, 
-                                    solid_mass_float=solid_mass_float, 
-                                    sample_weight_float=sample_weight_float
+                                    element_aes, mass_field_aes, probe,
+                                    solid_factor=solid_factor
                                 )
                                 if success:
                                     probe_modified = True
@@ -302,16 +321,13 @@ def process_mass_calculate(probe: dict):
                                 logger.error(traceback.format_exc())
                         
                         # Расчет для MS элементов
-                        for element in metal_elements_ms:
+                        for element, element_ms, mass_field_ms in ms_fields:
                             try:
-                                element_ms = f"{element}_MS"
                                 logger.debug(f"Обработка MS элемента {element} для твердой пробы")
                                 
                                 success, mass_field = calculate_mass_for_element(
-                                    element, element_ms, element_ms, probe, probe_name,
-                                    aliquot_float=aliquot_float, 
-                                    solid_mass_float=solid_mass_float, 
-                                    sample_weight_float=sample_weight_float
+                                    element_ms, mass_field_ms, probe,
+                                    solid_factor=solid_factor
                                 )
                                 if success:
                                     probe_modified = True
@@ -321,19 +337,16 @@ def process_mass_calculate(probe: dict):
                                 logger.error(traceback.format_exc())
                         
                         # Расчет для старых элементов без суффикса
-                        for element in metal_elements_base:
+                        for element, mass_field_base in base_fields:
                             try:
-                                if element in probe:
-                                    logger.debug(f"Обработка базового элемента {element} для твердой пробы")
-                                    success, mass_field = calculate_mass_for_element(
-                                        element, element, element, probe, probe_name,
-                                        aliquot_float=aliquot_float, 
-                                        solid_mass_float=solid_mass_float, 
-                                        sample_weight_float=sample_weight_float
-                                    )
-                                    if success:
-                                        probe_modified = True
-                                        logger.debug(f"Успешно рассчитан базовый элемент {element} для твердой пробы")
+                                logger.debug(f"Обработка базового элемента {element} для твердой пробы")
+                                success, mass_field = calculate_mass_for_element(
+                                    element, mass_field_base, probe,
+                                    solid_factor=solid_factor
+                                )
+                                if success:
+                                    probe_modified = True
+                                    logger.debug(f"Успешно рассчитан базовый элемент {element} для твердой пробы")
                             except Exception as e:
                                 logger.error(f"Ошибка при расчете базового элемента {element} для твердой пробы: {str(e)}")
                                 logger.error(traceback.format_exc())
@@ -344,10 +357,7 @@ def process_mass_calculate(probe: dict):
                     logger.error(f"solid_mass={solid_mass}, aliquot_volume={aliquot_volume}, sample_weight={sample_weight}") # type: ignore
                     logger.error(traceback.format_exc())
                     
-                    if 'tags' not in probe:
-                        probe['tags'] = []
-                    if 'ошибка расчета твердой пробы' not in probe['tags']:
-                        probe['tags'].append('ошибка расчета твердой пробы')
+                    if add_tag(probe, 'ошибка расчета твердой пробы'):
                         probe_modified = True
             else:
                 logger.warning(f"Отсутствует масса навески для твердой пробы {probe_name}")
@@ -358,10 +368,7 @@ def process_mass_calculate(probe: dict):
         logger.error(traceback.format_exc())
         
         # Добавляем тег об ошибке
-        if 'tags' not in probe:
-            probe['tags'] = []
-        if 'критическая ошибка расчета' not in probe['tags']:
-            probe['tags'].append('критическая ошибка расчета')
+        add_tag(probe, 'критическая ошибка расчета')
     
     if probe_modified:
         logger.info(f"Проба {probe.get('id', 'unknown')} успешно обработана с изменениями")
@@ -1,4 +1,5 @@
 import json
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -11,7 +12,10 @@ class MassBalanceVisualizer:
 
     def _flatten_data(self) -> pd.DataFrame:
         """Преобразует сложный JSON в плоскую таблицу для удобного анализа."""
-        rows = []
+        # Собираем колонки целиком: значения серии/элемента хранятся один раз
+        # на элемент и размножаются через np.repeat, без словаря на каждую строку
+        series_names, element_names, data_types, row_counts = [], [], [], []
+        stage_numbers, probe_types, masses = [], [], []
         for series_idx, series in enumerate(self.data):
             series_name = f"Series_{series_idx + 1}"
             elements_data = series.get("elements", {})
@@ -29,17 +33,26 @@ class MassBalanceVisualizer:
                     data_type = "Base"
 
                 # Извлекаем данные по стадиям
-                for stage_idx, stage_values in enumerate(details.get("stages", [])):
-                    for probe_type, mass in stage_values.items():
-                        rows.append({
-                            "series": series_name,
-                            "element": base_element,
-                            "data_type": data_type,
-                            "stage": stage_idx + 1,
-                            "probe_type": probe_type,
-                            "mass": float(mass)
-                        })
-        return pd.DataFrame(rows)
+                n_rows = 0
+                for stage_idx, stage_values in enumerate(details.get("stages", []), start=1):
+                    stage_numbers.extend([stage_idx] * len(stage_values))
+                    probe_types.extend(stage_values.keys())
+                    masses.extend(stage_values.values())
+                    n_rows += len(stage_values)
+                
+                series_names.append(series_name)
+                element_names.append(base_element)
+                data_types.append(data_type)
+                row_counts.append(n_rows)
+        
+        return pd.DataFrame({
+            "series": np.repeat(np.array(series_names, dtype=object), row_counts),
+            "element": np.repeat(np.array(element_names, dtype=object), row_counts),
+            "data_type": np.repeat(np.array(data_types, dtype=object), row_counts),
+            "stage": np.asarray(stage_numbers, dtype=np.int64),
+            "probe_type": probe_types,
+            "mass": np.asarray(masses, dtype=np.float64)
+        })
 
     def get_detailed_stats(self, elements: List[str] = None, series: List[str] = None): # type: ignore
         """Выводит сводную статистику по массам."""
@@ -98,28 +111,29 @@ class MassBalanceVisualizer:
             
             width = 0.8 / n_series  # Ширина одного столбца серии
             short_name_list = ['9-1','9-2','10-1','10-2','11-1','11-2']
-            for i, stage in enumerate(stages):
-                for j, series in enumerate(series_in_data):
-                    if (stage, series) not in pivot_df.index:
-                        continue
-                    
-                    data = pivot_df.loc[(stage, series)]
-                    bottom = 0
-                    x_pos = i + (j - (n_series - 1) / 2) * width
-                    
-                    # Рисуем сегменты (накопление)
-                    for probe in available_probes:
-                        val = data[probe]
-                        if val > 0: # type: ignore
-                            ax.bar(x_pos, val, width, bottom=bottom, 
-                                color=product_palette.get(probe, '#gray'),
-                                edgecolor='white', linewidth=0.5)
-                            bottom += val
-                    
-                    # Добавляем укороченное название серии (например, S1, S2)
-                    short_name = short_name_list[j]
-                    ax.text(x_pos, bottom + (bottom * 0.01), short_name,  # type: ignore
-                            ha='center', va='bottom', fontsize=9, rotation=0)
+            # Полная сетка (стадия, серия): позиции и накопление считаются массивами,
+            # а каждый продукт рисуется одним вызовом ax.bar
+            full_index = pd.MultiIndex.from_product([stages, series_in_data], names=['stage', 'series'])
+            present = full_index.isin(pivot_df.index)
+            grid = pivot_df.reindex(full_index, fill_value=0)
+            stage_idx, series_idx = np.divmod(np.arange(len(full_index)), n_series)
+            x_pos = stage_idx + (series_idx - (n_series - 1) / 2) * width
+            bottoms = np.zeros(len(full_index))
+            
+            # Рисуем сегменты (накопление)
+            for probe in available_probes:
+                vals = grid[probe].to_numpy(dtype=np.float64)
+                positive = present & (vals > 0)
+                if positive.any():
+                    ax.bar(x_pos[positive], vals[positive], width, bottom=bottoms[positive],
+                        color=product_palette.get(probe, '#gray'),
+                        edgecolor='white', linewidth=0.5)
+                bottoms += np.where(positive, vals, 0.0)
+            
+            # Добавляем укороченное название серии (например, S1, S2)
+            for x, bottom, j in zip(x_pos[present], bottoms[present], series_idx[present]):
+                ax.text(x, bottom + (bottom * 0.01), short_name_list[j],
+                        ha='center', va='bottom', fontsize=9, rotation=0)
 
             # Настройка оформления
             ax.set_xticks(range(len(stages)))
@@ -135,23 +149,23 @@ class MassBalanceVisualizer:
 
             plt.tight_layout()
 # --- Пример использования ---
-
-# Загрузка данных (замените на чтение вашего файла)
-with open(r"C:\Users\Kirill\Desktop\massbalance_api.json", 'r', encoding='utf-8') as f:
-     raw_data = json.load(f)
+if __name__ == '__main__':
+    # Загрузка данных (замените на чтение вашего файла)
+    with open(r"C:\Users\Kirill\Desktop\massbalance_api.json", 'r', encoding='utf-8') as f:
+         raw_data = json.load(f)
 
 
-viz = MassBalanceVisualizer(raw_data)
+    viz = MassBalanceVisualizer(raw_data)
 
-# 1. Вывод статистики по серебру (Ag)
-#viz.get_detailed_stats(elements=["mNi"])
+    # 1. Вывод статистики по серебру (Ag)
+    #viz.get_detailed_stats(elements=["mNi"])
 
-# 2. Визуализация масс для mAg (базовые данные)
-#viz.plot_element_mass_bar(element="mAg", data_type="Base")
+    # 2. Визуализация масс для mAg (базовые данные)
+    #viz.plot_element_mass_bar(element="mAg", data_type="Base")
 
-# 3. Сравнение данных из ИСП МС
-elem_list = ['mNi','mCu','mK','mPt','mPd','mRu','mMn','mCo','mZn','mAl']
-for em in elem_list:
-    viz.plot_stacked_mass_bar(element=em, data_type="MS",selected_series=['Series_18','Series_19','Series_20','Series_21','Series_22','Series_23'])
-    plt.savefig(fr"C:\Users\Kirill\Desktop\MassBalance\Плотность 3500, {em}.png")
-    plt.close()
\ No newline at end of file
+    # 3. Сравнение данных из ИСП МС
+    elem_list = ['mNi','mCu','mK','mPt','mPd','mRu','mMn','mCo','mZn','mAl']
+    for em in elem_list:
+        viz.plot_stacked_mass_bar(element=em, data_type="MS",selected_series=['Series_18','Series_19','Series_20','Series_21','Series_22','Series_23'])
+        plt.savefig(fr"C:\Users\Kirill\Desktop\MassBalance\Плотность 3500, {em}.png")
+        plt.close()
@@ -1,7 +1,8 @@
 from typing import Dict, Any, List, Optional, Tuple
 import json
+import math
 from pathlib import Path
-from middleware.series_worker import get_probe_type, get_probe_from_type, get_source_class_from_probe, get_probe_by_name
+from middleware.series_worker import get_probe_type, get_probe_from_type, get_source_class_from_probe, get_probe_by_name, get_probes_by_names
 from app.params import settings
 from mass_balance.algorithm_config import AtomicFileConfig
 import logging
@@ -16,9 +17,8 @@ BASE_DIR = Path(__file__).parent.parent.parent
 
 config = AtomicFileConfig()
 
-def get_analysis_coef(probe_name: str, default: float) -> float:
-    """Рассчитывает коэффициент на основе объема и аликвоты родительской пробы."""
-    probe = get_probe_by_name(probe_name)
+def get_analysis_coef(probe: Optional[Dict[str, Any]], default: float) -> float:
+    """Рассчитывает коэффициент на основе объема и аликвоты родительской пробы (уже загруженной из серии)."""
     if not probe:
         return default
     
@@ -32,7 +32,7 @@ def get_analysis_coef(probe_name: str, default: float) -> float:
     
     return default
 
-def apply_rebalance(probe: Dict[str, Any], field: str, coefs: List[float]) -> bool:
+def apply_rebalance(probe: Dict[str, Any], field: str, coefs: Tuple[float, ...]) -> bool:
     """Применяет произведение коэффициентов к полю и ставит флаг, чтобы избежать повтора."""
     suffix = "mass" if "mass" in field else "volume"
     flag_name = f'flag_rebalance_{suffix}'
@@ -42,9 +42,7 @@ def apply_rebalance(probe: Dict[str, Any], field: str, coefs: List[float]) -> bo
         
     original_val = probe.get(field)
     if original_val is not None:
-        total_coef = 1.0
-        for c in coefs:
-            total_coef *= c
+        total_coef = math.prod(coefs, start=1.0)
             
         probe[f'zero_{field}'] = original_val
         probe[field] = original_val * total_coef
@@ -160,6 +158,15 @@ def process_phase_calculate(probe: dict):
             logger.error(traceback.format_exc())
             return probe
 
+        # Связанные пробы загружаем по именам одним запросом
+        try:
+            series_probes = get_probes_by_names(names.values())
+            logger.debug(f"Найдено связанных проб: {len(series_probes)} из {len(names)}")
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке связанных проб для {p_name}: {str(e)}")
+            logger.error(traceback.format_exc())
+            return probe
+
         # Получаем коэффициенты из конфига
         try:
             logger.debug("Загрузка коэффициентов из конфига")
@@ -197,7 +204,7 @@ def process_phase_calculate(probe: dict):
                 logger.info(f"Обработка типа start_A для {p_name}")
                 
                 try:
-                    probe_c = get_probe_by_name(names['st_C'])
+                    probe_c = series_probes.get(names['st_C'])
                     logger.debug(f"Найдена связанная проба start_C: {probe_c.get('name') if probe_c else 'None'}")
                 except Exception as e:
                     logger.error(f"Ошибка при поиске start_C для {p_name}: {str(e)}")
@@ -263,7 +270,7 @@ def process_phase_calculate(probe: dict):
                     raise ValueError("Ошибка значения коэффициента")  
                           
                 try:
-                    probe_c = get_probe_by_name(names['st_C'])
+                    probe_c = series_probes.get(names['st_C'])
                     logger.debug(f"Найдена связанная проба start_C: {probe_c.get('name') if probe_c else 'None'}")
                 except Exception as e:
                     logger.error(f"Ошибка при поиске start_C для {p_name}: {str(e)}")
@@ -288,9 +295,9 @@ def process_phase_calculate(probe: dict):
                 logger.info(f"Обработка типа st2_A для {p_name}")
                 
                 try:
-                    parent = get_probe_by_name(names['st_A'])
-                    p_start_c = get_probe_by_name(names['st_C'])
-                    p_start_b = get_probe_by_name(names['st_B'])
+                    parent = series_probes.get(names['st_A'])
+                    p_start_c = series_probes.get(names['st_C'])
+                    p_start_b = series_probes.get(names['st_B'])
                     logger.debug(f"Найдена родительская проба st_A: {parent.get('name') if parent else 'None'}")
                 except Exception as e:
                     logger.error(f"Ошибка при поиске st_A для {p_name}: {str(e)}")
@@ -327,7 +334,7 @@ def process_phase_calculate(probe: dict):
                 logger.info(f"Обработка типа st2_B для {p_name}")
                 
                 try:
-                    parent = get_probe_by_name(names['st_B'])
+                    parent = series_probes.get(names['st_B'])
                     logger.debug(f"Найдена родительская проба st_B: {parent.get('name') if parent else 'None'}")
                 except Exception as e:
                     logger.error(f"Ошибка при поиске st_B для {p_name}: {str(e)}")
@@ -358,9 +365,9 @@ def process_phase_calculate(probe: dict):
                     logger.warning(f"  [!] Для {p_name} не найдена связанная проба st_B или отсутствует sample_mass")
                     
             elif probe_type == 'st3_B':
-                p_st2_b = get_probe_by_name(names['st2_B'])
-                p_st3_c = get_probe_by_name(names['st3_C'])
-                p_start_b = get_probe_by_name(names['st_B'])
+                p_st2_b = series_probes.get(names['st2_B'])
+                p_st3_c = series_probes.get(names['st3_C'])
+                p_start_b = series_probes.get(names['st_B'])
                 
                 if source_class[0] == 'T':
                     coeff_solid = solid_dencity_st3_param_T_type
@@ -403,8 +410,8 @@ def process_phase_calculate(probe: dict):
 
             elif probe_type == 'st3_A':
 
-                p_st2_a = get_probe_by_name(names['st2_A'])
-                p_st3_c = get_probe_by_name(names['st3_C'])
+                p_st2_a = series_probes.get(names['st2_A'])
+                p_st3_c = series_probes.get(names['st3_C'])
 
                 if source_class[0] == 'T':
                     coeff_solid = solid_dencity_st3_param_T_type
@@ -437,7 +444,7 @@ def process_phase_calculate(probe: dict):
 
             elif probe_type == 'st4_A':
                 
-                parent = get_probe_by_name(names['st3_A'])
+                parent = series_probes.get(names['st3_A'])
                 if parent and parent.get('V (ml)') is not None:
                     probe['V (ml)'] = parent['V (ml)']
                     is_updated = True
@@ -446,8 +453,8 @@ def process_phase_calculate(probe: dict):
 
             elif probe_type == 'st4_B':
                 
-                p_st3_b = get_probe_by_name(names['st3_B'])
-                p_st4_d = get_probe_by_name(names['st4_D'])
+                p_st3_b = series_probes.get(names['st3_B'])
+                p_st4_d = series_probes.get(names['st4_D'])
                 if p_st3_b and p_st4_d:
                     
                     m3 = p_st3_b.get('sample_mass')
@@ -459,27 +466,27 @@ def process_phase_calculate(probe: dict):
                 else:
                     logger.warning(f"  [!] Для {p_name} не найдена связанная проба st3_B или st4_D")
                     
-                c_leaching = get_analysis_coef(names['st2_A'], 1.05)
-                c_sulfur = get_analysis_coef(names['st3_A'], 1.025)
-                c_flotation = get_analysis_coef(names['st4_A'], 1.025)
+                c_leaching = get_analysis_coef(series_probes.get(names['st2_A']), 1.05)
+                c_sulfur = get_analysis_coef(series_probes.get(names['st3_A']), 1.025)
+                c_flotation = get_analysis_coef(series_probes.get(names['st4_A']), 1.025)
 
                 if probe_type == 'st3_B':
-                    if apply_rebalance(probe, 'sample_mass', [c_leaching]): is_updated = True
+                    if apply_rebalance(probe, 'sample_mass', (c_leaching,)): is_updated = True
                 
                 elif probe_type == 'st3_A':
-                    if apply_rebalance(probe, 'V (ml)', [c_leaching]): is_updated = True
+                    if apply_rebalance(probe, 'V (ml)', (c_leaching,)): is_updated = True
                 
                 elif probe_type == 'st4_A':
-                    if apply_rebalance(probe, 'V (ml)', [c_leaching, c_sulfur]): is_updated = True
+                    if apply_rebalance(probe, 'V (ml)', (c_leaching, c_sulfur)): is_updated = True
                     
                 elif probe_type == 'st4_B':
-                    if apply_rebalance(probe, 'sample_mass', [c_leaching, c_sulfur]): is_updated = True
+                    if apply_rebalance(probe, 'sample_mass', (c_leaching, c_sulfur)): is_updated = True
                     
                 elif probe_type == 'st4_D':
-                    if apply_rebalance(probe, 'sample_mass', [c_leaching, c_sulfur, 1.05]): is_updated = True
+                    if apply_rebalance(probe, 'sample_mass', (c_leaching, c_sulfur, 1.05)): is_updated = True
                     
                 elif probe_type == 'st6_E':
-                    coefs = [c_leaching, c_sulfur, c_flotation, 1.0125, 1.05]
+                    coefs = (c_leaching, c_sulfur, c_flotation, 1.0125, 1.05)
                     if apply_rebalance(probe, 'sample_mass', coefs): is_updated = True                                           
 
             
@@ -73,7 +73,10 @@ FIELD_VALIDATION_CONFIG = {
     },                
 }
 
-@dataclass
+# Список всех возможных типов проб
+ALL_PROBE_TYPES = list(PATTERNS.keys())
+
+@dataclass(slots=True)
 class ProbeInfo:
     """Информация о пробе"""
     probe: Dict[str, Any]
@@ -83,7 +86,7 @@ class ProbeInfo:
     source_class: str
     warnings: List[str]
 
-@dataclass
+@dataclass(slots=True)
 class SeriesInfo:
     """Информация о серии проб"""
     series_key: Tuple[str, int, int]
@@ -154,23 +157,19 @@ def analyze_series() -> Tuple[List[SeriesInfo], int]:
             warnings=warnings
         )
     
-    # Список всех возможных типов проб
-    all_probe_types = list(PATTERNS.keys())
-    
     # Формируем информацию о сериях
     series_list = []
     total_series = 0
     
     for series_key, probes_by_type in series_groups.items():
-        # Проверяем наличие хотя бы одной пробы из паттерна
-        if not any(pt in probes_by_type for pt in all_probe_types):
+        # Ключи probes_by_type - всегда типы из PATTERNS, достаточно проверить, что серия не пуста
+        if not probes_by_type:
             continue
         
         total_series += 1
         
         # Определяем отсутствующие типы
-        existing_types = set(probes_by_type.keys())
-        missing_types = [pt for pt in all_probe_types if pt not in existing_types]
+        missing_types = [pt for pt in ALL_PROBE_TYPES if pt not in probes_by_type]
         
         # Проверяем наличие предупреждений
         has_warnings = any(len(p.warnings) > 0 for p in probes_by_type.values())
@@ -179,7 +178,7 @@ def analyze_series() -> Tuple[List[SeriesInfo], int]:
             series_key=series_key,
             probes_by_type=probes_by_type,
             missing_types=missing_types,
-            all_types=all_probe_types,
+            all_types=ALL_PROBE_TYPES,
             has_warnings=has_warnings
         ))
     
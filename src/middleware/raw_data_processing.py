@@ -1,8 +1,19 @@
 import re
+import numpy as np
 import pandas as pd
+from functools import lru_cache
 from typing import Optional
 from pathlib import Path
 
+# Порядок стадий в полном шифре
+_STAGES_ORDER = 'LPFN'
+
+@lru_cache(maxsize=1024)
+def _stages_str(stage: str, method_num: str) -> str:
+    """Строка стадий от L до указанной включительно с номером методики: ('F', '5') -> 'L5P5F5'"""
+    target_index = _STAGES_ORDER.index(stage)
+    return ''.join(f"{s}{method_num}" for s in _STAGES_ORDER[:target_index + 1])
+
 def expand_sample_code(sample_name):
     """Восстанавливает полный шифр пробы из короткого используя паттерны из series_worker"""
     if pd.isna(sample_name):
@@ -28,23 +39,36 @@ def expand_sample_code(sample_name):
     if not stage or stage == 'L':
         return sample_str
     
-    # Определяем порядок стадий и какие нужно добавить
-    stages_order = ['L', 'P', 'F', 'N']
-    
-    # Находим индекс указанной стадии
-    target_index = stages_order.index(stage)
-    
-    # Берем все стадии от L до указанной включительно
-    needed_stages = stages_order[:target_index + 1]
-    
-    # Формируем строку стадий с номером методики
-    stages_str = ''.join([f"{s}{method_num}" for s in needed_stages])
-    
-    # Собираем полное имя
-    full_code = f"{prefix}-{stages_str}{product_type}{repeat_num}"
+    # Собираем полное имя (строка стадий берется из кэша)
+    full_code = f"{prefix}-{_stages_str(stage, method_num)}{product_type}{repeat_num}"
     
     return full_code
 
+def expand_sample_codes(names: pd.Series) -> pd.Series:
+    """Восстанавливает полные шифры для целого столбца имен, результат как у expand_sample_code"""
+    # Пустые значения остаются как есть, остальные приводятся к строке
+    text = names.astype(object).where(names.isna(), names.astype(str))
+    
+    # Компоненты короткого имени: префикс, стадия, номер методики, тип продукта, повторность
+    parts = text.str.extract(r'^([A-Z]\d+)-([LPFN]?)(\d+)([A-Z])(\d+)')
+    
+    # Раскрывать нужно только стадии P, F и N
+    needs_expand = parts[1].isin(['P', 'F', 'N'])
+    if not needs_expand.any():
+        return text
+    
+    parts = parts[needs_expand]
+    stage, method_num = parts[1], parts[2]
+    
+    # Строка стадий от L до указанной включительно с номером методики
+    lp = 'L' + method_num + 'P' + method_num
+    lpf = lp + 'F' + method_num
+    stages_str = lp.where(stage == 'P', lpf.where(stage == 'F', lpf + 'N' + method_num))
+    
+    result = text.copy()
+    result[needs_expand] = (parts[0] + '-' + stages_str + parts[3] + parts[4]).to_numpy()
+    return result
+
 def get_base_name(sample_name):
     """Извлекает базовое имя пробы (без последней цифры)"""
     if pd.isna(sample_name):
@@ -104,6 +128,54 @@ def clean_value_icp_aes(val):
     except:
         return 0
 
+def clean_column_icp_aes(column: pd.Series) -> pd.Series:
+    """Очищает целый столбец ИСП-АЭС, результат как у clean_value_icp_aes для каждой ячейки.
+    
+    В отличие от поэлементной очистки столбец всегда float64: 'некал' дает NaN, а не pd.NA
+    в столбце object. Поэтому merge_similar_samples усредняет такой столбец по остальным
+    повторностям, а не отбрасывает его целиком из-за одной ячейки 'некал'.
+    """
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        return column.astype(float).fillna(0)
+    
+    text = column.astype(str).str.strip()
+    lower = text.str.lower()
+    
+    # Пометки в порядке приоритета clean_value_icp_aes: некал -> uv -> ox -> x
+    nekal = lower.str.contains('некал', regex=False)
+    uv = lower.str.contains('uv', regex=False) & ~nekal
+    ox = lower.str.contains('ox', regex=False) & ~nekal & ~uv
+    x = lower.str.contains('x', regex=False) & ~nekal & ~uv & ~ox
+    
+    # Обычные числа (запятая как разделитель допускается), пустые и нечисловые -> 0
+    result = pd.to_numeric(text.str.replace(',', '.', regex=False), errors='coerce').fillna(0).astype(float)
+    
+    # Для ox и x удаляем пометку и оставляем число, иначе ошибка
+    for mask, marker in ((ox, 'ox'), (x, 'x')):
+        if mask.any():
+            values = pd.to_numeric(lower[mask].str.replace(marker, '', regex=False).str.strip(), errors='coerce')
+            if values.isna().any():
+                raise ValueError(f'Ошибка удаления {marker}')
+            result[mask] = values
+    
+    result[uv] = 0.0
+    # некал - NaN для последующего удаления
+    result[nekal] = np.nan
+    
+    return result
+
+def _mcg_per_l_divisor(unit) -> Optional[float]:
+    """Делитель для пересчета в единицы ИСП-МС, None - единица неизвестна"""
+    unit_lower = str(unit).lower()
+    
+    if 'мг/л' in unit_lower or 'mg/l' in unit_lower:
+        return 1  # 1 мг/л = 1000 мкг/л
+    elif 'нг/л' in unit_lower or 'ng/l' in unit_lower:
+        return 1000*1000  # 1 нг/л = 0.001 мкг/л
+    elif 'мкг/л' in unit_lower or 'µg/l' in unit_lower or 'mcg/l' in unit_lower:
+        return 1000  # уже в мкг/л
+    return None
+
 def convert_to_mcg_per_l(value, unit):
     """Конвертирует значение в мкг/л для ИСП-МС данных"""
     if pd.isna(value):
@@ -114,15 +186,24 @@ def convert_to_mcg_per_l(value, unit):
     except:
         return value
     
-    unit_lower = str(unit).lower()
-    
-    if 'мг/л' in unit_lower or 'mg/l' in unit_lower:
-        return value  # 1 мг/л = 1000 мкг/л
-    elif 'нг/л' in unit_lower or 'ng/l' in unit_lower:
-        return value / (1000*1000)  # 1 нг/л = 0.001 мкг/л
-    elif 'мкг/л' in unit_lower or 'µg/l' in unit_lower or 'mcg/l' in unit_lower:
-        return value / 1000  # уже в мкг/л
-    else:
+    divisor = _mcg_per_l_divisor(unit)
+    if divisor is None:
         # Если единица измерения неизвестна, оставляем как есть
         print(f"Неизвестная единица измерения: {unit}. Оставляю значение без изменений.")
-        return value
\ No newline at end of file
+        return value
+    return value / divisor
+
+def convert_column_to_mcg_per_l(column: pd.Series, unit) -> pd.Series:
+    """Пересчитывает целый столбец в мкг/л: единица одна на столбец, делитель считается один раз"""
+    numeric = pd.to_numeric(column, errors='coerce')
+    
+    divisor = _mcg_per_l_divisor(unit)
+    if divisor is None:
+        # Если единица измерения неизвестна, оставляем как есть
+        print(f"Неизвестная единица измерения: {unit}. Оставляю значения без изменений.")
+        converted = numeric
+    else:
+        converted = numeric / divisor
+    
+    # Нечисловые ячейки остаются без изменений, как в convert_to_mcg_per_l
+    return converted.where(numeric.notna(), column)
\ No newline at end of file
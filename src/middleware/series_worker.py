@@ -1,10 +1,10 @@
-import json
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List, Union, Optional
+from typing import Dict, Any, Iterable, List, Union, Optional
 import sys
 sys.path.insert(0, r'D:\lab\Norilsk')
-from src.database import get_db_connection
+from src.database import get_db_connection, loads_json
 
 # Регулярные выражения для определения всех типов проб
 PATTERNS = {
@@ -21,13 +21,24 @@ PATTERNS = {
     'st4_B': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1B(\d+)$"),
     'st4_D': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1D(\d+)$"),
     'st4_C': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1C(\d+)$"),
-    'st5_A': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1A(\d+)$"),
-    'st5_B': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1B(\d+)$"),
-    'st5_C': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1C(\d+)$"),        
+    # st5_A/B/C совпадали с st4_A/B/C посимвольно и никогда не срабатывали - такие имена всегда st4
     'st6_E': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1N\1E(\d+)$"),
     'st6_G': re.compile(r"^[A-Z]\d-L(\d+)P\1F\1N\1G(\d+)$")
 }
 
+# Одна регулярка на все типы: глубина стадии (L, P, F, N) и буква продукта
+# разбираются за один проход, тип берется из таблицы ниже
+_PROBE_NAME_RE = re.compile(r"^[A-Z]\d-(?:(\d+)|L(\d+)(P\2(F\2(N\2)?)?)?)([A-Z])(\d+)$")
+
+# (глубина стадии, буква) -> тип пробы. Глубина: 0 - исходная, 1 - L, 2 - LP, 3 - LPF, 4 - LPFN
+_PROBE_TYPE_BY_STAGE = {
+    (0, 'A'): 'start_A', (0, 'B'): 'start_B', (0, 'C'): 'start_C',
+    (1, 'A'): 'st2_A', (1, 'B'): 'st2_B', (1, 'C'): 'st2_C',
+    (2, 'A'): 'st3_A', (2, 'B'): 'st3_B', (2, 'C'): 'st3_C',
+    (3, 'A'): 'st4_A', (3, 'B'): 'st4_B', (3, 'D'): 'st4_D', (3, 'C'): 'st4_C',
+    (4, 'E'): 'st6_E', (4, 'G'): 'st6_G',
+}
+
 TYPE_NAMES = {
     'start_A' : 'Жидкая фаза исходной пульпы',
     'start_B' : 'Твердая фаза исходной пульпы',
@@ -65,26 +76,33 @@ def get_source_class_from_probe(probe:dict) -> str|None:
         split_name = probe_name.split(sep='-')
         return split_name[0]
 
+@lru_cache(maxsize=100_000)
+def parse_probe_type(probe_name: str) -> tuple[str,int,int]|None:
+    """Тип пробы по имени. Имена повторяются между запросами, поэтому результат кэшируется"""
+    
+    match = _PROBE_NAME_RE.match(probe_name)
+    if not match:
+        return None
+    
+    start_m, stage_m, p_stage, f_stage, n_stage, letter, n_str = match.groups()
+    if start_m is not None:
+        depth = 0
+    else:
+        depth = 1 + (p_stage is not None) + (f_stage is not None) + (n_stage is not None)
+    
+    # Определяем тип пробы
+    probe_type = _PROBE_TYPE_BY_STAGE.get((depth, letter))
+    m = int(start_m if start_m is not None else stage_m)  # Номер методики
+    n = int(n_str)  # Номер повторности
+    
+    if probe_type and m and n:
+        return probe_type, m, n
+
 def get_probe_type(probe) -> tuple[str,int,int]|None:    
     
     probe_name = probe.get('name', '')        
     if probe_name:
-    
-        m = None
-        n = None
-        probe_type = None
-        
-        # Определяем тип пробы
-        for pattern_name, pattern in PATTERNS.items():
-            match = pattern.match(probe_name)
-            if match:
-                probe_type = pattern_name
-                m = int(match.group(1))  # Номер методики
-                n = int(match.group(2))  # Номер повторности
-                break
-        
-        if probe_type and m and n:
-            return probe_type, m, n
+        return parse_probe_type(probe_name)
 
 def get_probe_from_type(probe_type: str, method_number: int, exp_number: int) -> Optional[dict]:
     """Находит одну конкретную пробу по её типу и номерам методики/эксперимента"""
@@ -96,7 +114,29 @@ def get_probe_from_type(probe_type: str, method_number: int, exp_number: int) ->
             LIMIT 1
         """, (probe_type, method_number, exp_number)).fetchone()
         
-        return json.loads(row['raw_data']) if row else None
+        return loads_json(row['raw_data']) if row else None
+    
+def get_probes_by_names(names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Пробы с указанными именами за один запрос: { имя_пробы: объект_пробы }.
+    Ищет по имени, как get_probe_by_name; при повторе имени берется первая запись.
+    """
+    unique_names = list(dict.fromkeys(names))
+    if not unique_names:
+        return {}
+    
+    placeholders = ', '.join('?' * len(unique_names))
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT name, raw_data FROM probes WHERE name IN ({placeholders})",
+            unique_names
+        ).fetchall()
+        
+        result = {}
+        for row in rows:
+            if row['name'] not in result:
+                result[row['name']] = loads_json(row['raw_data'])
+        return result
     
 def get_series_probes() -> List[Dict[str, Any]]:
     """
@@ -117,7 +157,7 @@ def get_series_probes() -> List[Dict[str, Any]]:
         """
         rows = conn.execute(query).fetchall()
         
-        result_probes = [json.loads(row['raw_data']) for row in rows]
+        result_probes = [loads_json(row['raw_data']) for row in rows]
         print(f"Найдено проб в валидных сериях: {len(result_probes)}")
         return result_probes
     
@@ -150,7 +190,7 @@ def get_series_dicts() -> List[Dict[str, Dict[str, Any]]]:
                 series_groups[key] = {}
             
             # Наполняем словарь серии: { 'start_A': {...}, 'st2_B': {...} }
-            series_groups[key][row['probe_type']] = json.loads(row['raw_data'])
+            series_groups[key][row['probe_type']] = loads_json(row['raw_data'])
             
         return list(series_groups.values())
     
@@ -183,4 +223,4 @@ def get_probe_by_name(target_name):
         ).fetchone()
         
         # Если нашли — парсим JSON, если нет — возвращаем None
-        return json.loads(row['raw_data']) if row else None            
\ No newline at end of file
+        return loads_json(row['raw_data']) if row else None            
\ No newline at end of file
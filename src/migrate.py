@@ -4,6 +4,7 @@ import os
 from pathlib import Path
 # Импортируем ваши функции парсинга
 from middleware.series_worker import get_probe_type, get_source_class_from_probe
+from database import PROBE_INDEXES
 
 # Конфигурация путей
 BASE_DIR = Path(__file__).parent.parent
@@ -31,6 +32,8 @@ def init_database():
     cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_recalc ON probes(flag_needs_recalculation) WHERE flag_needs_recalculation = 1;        
     ''')
+    for statement in PROBE_INDEXES:
+        cursor.execute(statement)
     conn.commit()
     return conn
 
@@ -1,6 +1,8 @@
 import time
+import copy
 import json
-from database import get_db_connection
+import orjson
+from database import get_db_connection, ensure_indexes, loads_json
 from mass_balance import mass_calculate, phase_calculate # ваши функции
 import os
 import hashlib
@@ -21,6 +23,9 @@ def run_worker():
     
     logger.info("Worker запущен")
     
+    # Поиск связанных проб идет по имени и по серии - индексы нужны до начала обработки
+    ensure_indexes()
+    
     while True:
         try:
             current_time = time.time()
@@ -73,7 +78,9 @@ def run_worker():
                             conn.execute("UPDATE probes SET flag_needs_recalculation = 2 WHERE id = ?", (probe_id,))
                             continue
                         
-                        probe = json.loads(row['raw_data'])
+                        probe = loads_json(row['raw_data'])
+                        # Расчеты меняют пробу на месте: исходные данные сохраняем для сравнения
+                        original = copy.deepcopy(probe)
                         logger.debug(f"Загружена проба id={probe_id}, name={probe.get('name', 'unknown')}")
                         
                         if 'id' not in probe:
@@ -102,12 +109,17 @@ def run_worker():
                             logger.error(traceback.format_exc())
                             probe['tags'].append('ошибка mass_calculate') # type: ignore
                         
-                        # Сохраняем результат
-                        conn.execute("""
-                            UPDATE probes 
-                            SET raw_data = ?, flag_needs_recalculation = 0 
-                            WHERE id = ?
-                        """, (json.dumps(probe, ensure_ascii=False), probe_id))
+                        # Сохраняем результат (raw_data - только если расчет что-то изменил).
+                        # Сравниваем данные, а не текст: строки пишутся и json.dumps, и orjson
+                        if probe != original:
+                            new_raw_data = orjson.dumps(probe).decode('utf-8')
+                            conn.execute("""
+                                UPDATE probes 
+                                SET raw_data = ?, flag_needs_recalculation = 0 
+                                WHERE id = ?
+                            """, (new_raw_data, probe_id))
+                        else:
+                            conn.execute("UPDATE probes SET flag_needs_recalculation = 0 WHERE id = ?", (probe_id,))
                         
                         logger.info(f"Проба id={probe_id} успешно обработана")
                         
@@ -168,7 +180,8 @@ def recalc_all_probes():
                         error_count += 1
                         continue
                     
-                    probe = json.loads(row['raw_data'])
+                    probe = loads_json(row['raw_data'])
+                    original = copy.deepcopy(probe)
                     
                     if 'id' not in probe:
                         probe['id'] = probe_id
@@ -177,12 +190,14 @@ def recalc_all_probes():
                     probe = phase_calculate.process_phase_calculate(probe)
                     probe = mass_calculate.process_mass_calculate(probe)
                     
-                    # Обновляем запись
-                    conn.execute("""
-                        UPDATE probes 
-                        SET raw_data = ? 
-                        WHERE id = ?
-                    """, (json.dumps(probe), probe_id))
+                    # Обновляем запись, если пересчет изменил данные (сравнение не зависит от сериализатора)
+                    if probe != original:
+                        new_raw_data = orjson.dumps(probe).decode('utf-8')
+                        conn.execute("""
+                            UPDATE probes 
+                            SET raw_data = ? 
+                            WHERE id = ?
+                        """, (new_raw_data, probe_id))
                     
                     success_count += 1
                     
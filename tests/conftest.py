@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Модули приложения импортируются из src, как в контейнере (WORKDIR /src)
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_DIR))
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+
+@pytest.fixture
+def icp_aes_csv() -> Path:
+    """CSV ИСП-АЭС: повторности с 'некал', пометки uv/x и металл с одной длиной волны"""
+    return FIXTURES_DIR / 'icp_aes_sample.csv'
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from handlers.ISP_AES import aggregate_metal_wavelengths, process_icp_aes_data
+from middleware.raw_data_processing import clean_column_icp_aes
+
+
+def test_process_icp_aes_data_averages_merged_sample_over_nekal(icp_aes_csv):
+    result, _ = process_icp_aes_data(str(icp_aes_csv))
+    merged = result.set_index('name').loc['T2-L5P5F5N5A1']
+    
+    # Cu 324.754: у второй повторности 'некал', остается 4.0; Cu 327.395: (4.4 + 4.2) / 2
+    assert merged['Cu_AES'] == pytest.approx((4.0 + 4.3) / 2)
+
+
+def _old_metal_mean_std(df, metal_columns):
+    """Прежний расчет: mean/std по строке для каждого металла, одна длина волны - СКО 0"""
+    means, stds = {}, {}
+    for metal, cols in metal_columns.items():
+        metal_df = df[cols]
+        if len(cols) > 1:
+            means[metal] = metal_df.mean(axis=1)
+            stds[metal] = metal_df.std(axis=1)
+        else:
+            means[metal] = metal_df.iloc[:, 0]
+            stds[metal] = pd.Series(0, index=metal_df.index)
+    return pd.DataFrame(means), pd.DataFrame(stds)
+
+
+def test_aggregate_metal_wavelengths_matches_row_wise_path(icp_aes_csv):
+    df = pd.read_csv(icp_aes_csv, sep=';', encoding='utf-8').iloc[:4]
+    value_cols = [col for col in df.columns if col != 'Проба']
+    for col in value_cols:
+        df[col] = clean_column_icp_aes(df[col])
+    metal_columns = {
+        'Fe': ['Fe 238.204', 'Fe 239.562', 'Fe 259.940'],
+        'Cu': ['Cu 324.754', 'Cu 327.395'],
+        'Zn': ['Zn 213.857'],
+    }
+    
+    means, stds = aggregate_metal_wavelengths(df, metal_columns)
+    old_means, old_stds = _old_metal_mean_std(df, metal_columns)
+    
+    assert list(means.columns) == list(metal_columns)
+    pd.testing.assert_frame_equal(means, old_means, check_dtype=False)
+    pd.testing.assert_frame_equal(stds, old_stds, check_dtype=False)
+    # Металл с одной длиной волны: среднее - само значение, СКО - 0
+    assert stds['Zn'].tolist() == [0.0, 0.0, 0.0, 0.0]
+    # 'некал' в одной из длин волн Cu: среднее по оставшейся, СКО не определено
+    assert means.loc[2, 'Cu'] == 4.2
+    assert np.isnan(stds.loc[2, 'Cu'])
+
+
+def test_aggregate_metal_wavelengths_without_metals():
+    df = pd.DataFrame({'name': ['T2-5A1']})
+    
+    means, stds = aggregate_metal_wavelengths(df, {})
+    
+    assert means.empty and stds.empty
+    assert means.index.equals(df.index)
+
+
+def test_process_icp_aes_data_metal_columns(icp_aes_csv):
+    result, wavelengths = process_icp_aes_data(str(icp_aes_csv))
+    
+    assert list(result.columns) == ['name', 'Cu_AES', 'Fe_AES', 'Zn_AES', 'dCu', 'dFe', 'Масса навески (g)']
+    assert wavelengths['Металл'].tolist() == ['Cu', 'Fe', 'Zn']
+    assert wavelengths['Количество_длин_волн'].tolist() == [2, 3, 1]
+    # Zn измерен на одной длине волны: СКО 0 во всех пробах, нулевой столбец dZn удаляется
+    assert result.set_index('name').loc['T2-L5P5B1', 'Zn_AES'] == 2.5
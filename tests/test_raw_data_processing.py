@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from middleware.raw_data_processing import (
+    clean_column_icp_aes,
+    clean_value_icp_aes,
+    merge_similar_samples,
+)
+
+
+RAW_VALUES = ['10,5', ' 4.2 ', 'некал', 'UV', '12.3 x', '7 ox', '', 'abc', np.nan, '0']
+
+
+def test_clean_column_icp_aes_matches_clean_value():
+    column = pd.Series(RAW_VALUES, dtype=object)
+    
+    cleaned = clean_column_icp_aes(column)
+    
+    for raw, value in zip(RAW_VALUES, cleaned):
+        expected = clean_value_icp_aes(raw)
+        if pd.isna(expected):
+            assert np.isnan(value)
+        else:
+            assert value == expected
+
+
+def test_clean_column_icp_aes_is_float_with_nekal():
+    cleaned = clean_column_icp_aes(pd.Series(['1.5', 'некал', 'uv'], dtype=object))
+    
+    assert cleaned.dtype == np.float64
+    assert cleaned.tolist()[0] == 1.5
+    assert np.isnan(cleaned.iloc[1])
+    assert cleaned.iloc[2] == 0.0
+
+
+@pytest.mark.parametrize('marker', ['x', 'ox'])
+def test_clean_column_icp_aes_raises_on_bad_marker_value(marker):
+    with pytest.raises(ValueError, match=f'Ошибка удаления {marker}'):
+        clean_column_icp_aes(pd.Series(['1.0', f'abc {marker}'], dtype=object))
+
+
+def test_merge_similar_samples_keeps_column_with_nekal_replicate():
+    group = pd.DataFrame({
+        'name': ['T2-N5A11', 'T2-N5A12'],
+        'Cu 324.754': clean_column_icp_aes(pd.Series(['4.0', 'некал'], dtype=object)),
+        'Cu 327.395': clean_column_icp_aes(pd.Series(['4.4', '4.2'], dtype=object)),
+    })
+    
+    merged = merge_similar_samples(group)
+    
+    # Столбец с 'некал' в одной повторности усредняется по остальным, а не пропадает
+    assert merged['Cu 324.754'] == pytest.approx(4.0)
+    assert merged['Cu 327.395'] == pytest.approx(4.3)
+    assert merged['name'] == 'T2-N5A1'